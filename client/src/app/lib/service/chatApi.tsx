@@ -65,15 +65,26 @@ interface DocumentApiResponse{
   id: any;
     title: any;
     filename: any;
+  next_cursor?: string | null;
 }
 
 export const DocumentService = {
+  // The endpoint is paginated; follow next_cursor so callers get every document
   getDocuments: async (token: string): Promise<DocumentApiResponse> => {
-    const response = await chatApi.get('/pdf/documents', {
-      headers: { Authorization: `Bearer ${token}` },
-    });
-    console.log("data",response.data);
-    return response.data;
+    const documents: any[] = [];
+    let cursor: string | null = null;
+    let data: any;
+    do {
+      const response: { data: any } = await chatApi.get('/pdf/documents', {
+        headers: { Authorization: `Bearer ${token}` },
+        params: { limit: 200, ...(cursor ? { cursor } : {}) },
+      });
+      data = response.data;
+      documents.push(...data.document);
+      cursor = data.next_cursor;
+    } while (cursor);
+    console.log("data", documents);
+    return { ...data, document: documents, next_cursor: null };
   },
 };
 
@@ -1,4 +1,4 @@
-from flask import Flask
+from flask import Flask, jsonify
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
@@ -28,6 +28,15 @@ def create_app():
         }
     })
     bcrypt.init_app(app)
+
+    from .services.scheduler import Overloaded
+
+    @app.errorhandler(Overloaded)
+    def overloaded(e):
+        response = jsonify({'error': 'Server is busy, please retry', 'workload': e.workload})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
     
     from .auth import auth_bp
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
@@ -27,6 +27,9 @@ class PdfData(db.Model):
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_at = db.Column(db.DateTime, server_default=db.func.now())
     pdf_size = db.Column(db.String(32), nullable=False)
+    content_hash = db.Column(db.String(64), nullable=True)
+    # Backs the keyset pagination in GET /api/pdf/documents
+    __table_args__ = (db.Index('ix_pdf_data_user_created_id', 'user_id', 'created_at', 'id'),)
     def __repr__(self):
         return f'<PdfData {self.filename}>'
 
@@ -39,6 +42,15 @@ class ChatHistory(db.Model):
 
 class Answershare(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    token = db.Column(db.String(256), unique= True, default=lambda:str(uuid.uuid4()))
+    # uuid4 bytes; links show it as the usual hyphenated string (see services/share_cache.py)
+    token = db.Column(db.BINARY(16), unique=True, nullable=False, default=lambda: uuid.uuid4().bytes)
     answer = db.Column(db.Text)
-    created_at = db.Column(db.DateTime, server_default=db.func.now())
\ No newline at end of file
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
+
+
+class SummaryChunk(db.Model):
+    __tablename__ = 'summary_chunk'
+    # sha256 of the prompt version and the prompt sent for one section
+    chunk_hash = db.Column(db.String(64), primary_key=True)
+    summary = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, server_default=db.func.now())
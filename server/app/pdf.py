@@ -1,31 +1,83 @@
 import os
+import click
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, send_file
 from .models import PdfData, User
 from . import db
-from pdfminer.high_level import extract_text
 from werkzeug.utils import secure_filename
-from .services.embedding import chunk_text, embed_text
-import numpy as np
-import faiss
-from PIL import Image
+from .services.chunker import chunk_pages
+from .services.embedding import embedding_model
+from .services.ocr import read_image_text
+from .services.extraction import extract_pages, extract_text_layer, ocr_scanned_pages, extract_document_text
+from .services.llm import chat_completion
+from .services.scheduler import scheduler, Overloaded, WORKLOADS, CPU_UNITS
+from .services.summarize import summarize_content
+from .services.index_store import store_document, remove_document, reset_document, check_consistency, INDEX_VERSION
+from .services.reindex import reindex, prune_versions, CHECKPOINT_PATH
 import json
+import asyncio
+import base64
+import hashlib
+import zipfile
+import mimetypes
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import defer
+from urllib.parse import quote
 # import pytesseract
 import traceback
 # import pdf2image
-import requests
 from dotenv import load_dotenv
 load_dotenv()
-import easyocr 
 
 
 pdf_bp = Blueprint('pdf', __name__)
 UPLOAD_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
-embedding_size = 384
-index = faiss.IndexFlatL2(embedding_size)
-chunk_metadata = []
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def reserve_upload(filename):
+    """
+    Claim a name in UPLOAD_FOLDER that no file or PdfData row uses yet:
+    ``filename``, else ``name-1.ext``, ``name-2.ext``... and return
+    (name, path). The empty file is created here, so concurrent uploads never
+    share a name. An upload therefore never replaces another document's file,
+    and the content_hash stored with a row stays true for its file.
+    """
+    stem, ext = os.path.splitext(filename)
+    n = 0
+    while True:
+        name = f"{stem}-{n}{ext}" if n else filename
+        path = os.path.join(UPLOAD_FOLDER, name)
+        n += 1
+        if db.session.query(PdfData.id).filter_by(filename=name).first():
+            continue
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            continue
+        return name, path
+
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
 
 
 
@@ -46,57 +98,67 @@ def upload_pdf():
     if not file.filename.lower().endswith('.pdf'):
         return jsonify({"msg": "Only PDF files are allowed"}), 400
 
-    filename = secure_filename(file.filename)
-    file_path = os.path.join(UPLOAD_FOLDER, filename)
+    user_id_str = get_jwt_identity()
+
 
-    
     try:
+        user_id = int(user_id_str)
+    except (ValueError, TypeError):
+        return jsonify({"msg": "Invalid user identity"}), 401
+
+    file_path = None
+    try:
+        filename, file_path = reserve_upload(secure_filename(file.filename))
         file.save(file_path)
         pdf_size = f"{os.path.getsize(file_path) / 1024:.1f} KB"
+        content_hash = file_sha256(file_path)
     except Exception as e:
+        if file_path:
+            _discard(file_path)
         return jsonify({"msg": "Failed to save file", "error": str(e)}), 500
 
 
     try:
-        pdf_content = extract_text(file_path)
-        if not pdf_content.strip():
+        # Scanned pages without a text layer are OCR'd
+        pages = extract_pages(file_path)
+        if not any(page['text'].strip() for page in pages):
+            _discard(file_path)
             return jsonify({"msg": "PDF appears to be empty or unreadable"}), 400
+    except Overloaded:
+        _discard(file_path)
+        raise
     except Exception as e:
+        _discard(file_path)
         return jsonify({"msg": "Failed to extract text from PDF", "error": str(e)}), 500
 
-        
-    user_id_str = get_jwt_identity()
-
-
-    try:
-        user_id = int(user_id_str)
-    except (ValueError, TypeError):
-        return jsonify({"msg": "Invalid user identity"}), 401
-
 
+    committed = False
     try:
         user = User.query.get(user_id)
         if not user:
+            _discard(file_path)
             return jsonify({"msg": "User not found"}), 404
-        pdf_record = PdfData(filename=filename, user_id=user_id, pdf_size=pdf_size, file_type='pdf')
+        pdf_record = PdfData(filename=filename, user_id=user_id, pdf_size=pdf_size, file_type='pdf', content_hash=content_hash)
         db.session.add(pdf_record)
         db.session.commit()
-        chunks = chunk_text(pdf_content)
-        vectors=[]
-        for chunk in chunks:
-            vector = np.array(embed_text(chunk), dtype=np.float32)
-            vectors.append(vector)
-            chunk_metadata.append({
-                "text": chunk,
-                "user_id": user_id,
-                "file_id": pdf_record.id
-                
-            })
-        index.add(np.array(vectors))
+        committed = True
+        # A reused pdf_id must not pick up an index left from a previous document
+        reset_document(user_id, pdf_record.id)
+        _embed_document(pdf_record.id, user_id, pages)
 
 
+    except Overloaded:
+        # The row is kept; the QA index is built on the first question instead
+        db.session.rollback()
+        return jsonify({
+            "msg": "File uploaded, indexing deferred",
+            "pdf_id": pdf_record.id,
+            "filename": filename,
+        }), 201
     except Exception as e:
         db.session.rollback()
+        if not committed:
+            _discard(file_path)
         print(f"Database error: {e}")
         traceback.print_exc()
         return jsonify({"msg": "Database error", "error": str(e)}), 500
@@ -109,6 +171,190 @@ def upload_pdf():
         # "file_text": pdf_content[:500]
     }), 201
 
+BULK_MAX_FILES = 500
+# Total uncompressed size accepted from one bulk request (also guards against zip bombs)
+BULK_MAX_BYTES = 2 * 1024 ** 3
+# Capped to the worker's CPU budget; each extraction also holds an 'extract' slot
+BULK_EXTRACT_WORKERS = min(int(os.getenv('BULK_EXTRACT_WORKERS', WORKLOADS['extract']['slots'])), CPU_UNITS)
+_extract_pool = None
+_extract_pool_lock = threading.Lock()
+_extract_executor = ThreadPoolExecutor(max_workers=BULK_EXTRACT_WORKERS, thread_name_prefix='bulk-extract')
+# Bulk embedding jobs queue here so they never occupy the QA executor
+_ingest_executor = ThreadPoolExecutor(max_workers=WORKLOADS['ingest']['slots'], thread_name_prefix='ingest')
+
+
+def _get_extract_pool():
+    # pdfminer is pure Python, so extraction runs in processes rather than threads.
+    # Spawned, not forked, so children don't inherit the models or torch's threads.
+    # Bulk requests fan out on several threads, which must all share one pool
+    global _extract_pool
+    with _extract_pool_lock:
+        if _extract_pool is None:
+            _extract_pool = ProcessPoolExecutor(max_workers=BULK_EXTRACT_WORKERS,
+                                                mp_context=multiprocessing.get_context('spawn'))
+    return _extract_pool
+
+
+def _extract_bulk_file(file_path):
+    # Only the text layer is read in the pool, so children never load EasyOCR.
+    # Scanned pages are OCR'd here with the worker's shared model and 'ocr' slots.
+    with scheduler.slot('extract'):
+        pages = _get_extract_pool().submit(extract_text_layer, file_path).result()
+    return ocr_scanned_pages(file_path, pages)
+
+
+def _save_stream(src, dest_path, budget):
+    """Copy ``src`` to ``dest_path`` and return (size, sha256), refusing to exceed ``budget`` bytes."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(dest_path, 'wb') as dst:
+        for block in iter(lambda: src.read(1024 * 1024), b''):
+            size += len(block)
+            if size > budget:
+                raise ValueError("Bulk upload size limit exceeded")
+            digest.update(block)
+            dst.write(block)
+    return size, digest.hexdigest()
+
+
+def _iter_bulk_sources():
+    """Yield (original name, readable stream) for every uploaded file and zip entry."""
+    for file in request.files.getlist('files'):
+        yield file.filename, file.stream
+    archive = request.files.get('archive')
+    if archive:
+        # Entries are read straight from the uploaded archive, never unpacked to disk
+        with zipfile.ZipFile(archive.stream) as zf:
+            for info in zf.infolist():
+                if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                    continue
+                with zf.open(info) as entry:
+                    yield info.filename, entry
+
+
+def _embed_document(pdf_id, user_id, pages):
+    """Chunk, embed and store the document's QA index at upload instead of on its first question."""
+    chunks = chunk_pages(pages)
+    if chunks:
+        with scheduler.slot('ingest'):
+            vectors = embedding_model.encode([chunk['text'] for chunk in chunks])
+        store_document(user_id, pdf_id, chunks, vectors)
+
+
+@pdf_bp.route('/upload/bulk', methods=['POST'])
+@jwt_required()
+def upload_bulk():
+    """
+    Upload many PDFs at once, as repeated ``files`` fields and/or one zip
+    ``archive``. Text is extracted in a process pool, all rows are inserted in
+    one transaction and documents are embedded in parallel. Returns a status
+    entry per file.
+    """
+    try:
+        user_id = int(get_jwt_identity())
+    except (ValueError, TypeError):
+        return jsonify({"msg": "Invalid user identity"}), 401
+    if not User.query.get(user_id):
+        return jsonify({"msg": "User not found"}), 404
+    if not request.files.getlist('files') and 'archive' not in request.files:
+        return jsonify({"msg": "No files or archive provided"}), 400
+    # Sheds with 429 when bulk uploads are already queued
+    with scheduler.slot('bulk'):
+        return _ingest_bulk(user_id)
+
+
+def _ingest_bulk(user_id):
+    # Files are staged in a private folder next to the uploads and moved into
+    # place only once their rows are committed; everything else is deleted.
+    staging = tempfile.mkdtemp(prefix='.bulk-', dir=UPLOAD_FOLDER)
+    try:
+        return _ingest_staged(user_id, staging)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def _ingest_staged(user_id, staging):
+    report = []
+    saved = []
+    seen = set()
+    budget = BULK_MAX_BYTES
+    try:
+        for name, stream in _iter_bulk_sources():
+            filename = secure_filename(os.path.basename(name))
+            entry = {"filename": filename or name}
+            report.append(entry)
+            if not filename.lower().endswith('.pdf'):
+                entry.update(status="skipped", error="Only PDF files are allowed")
+                continue
+            if filename in seen:
+                entry.update(status="skipped", error="Duplicate filename in this upload")
+                continue
+            if len(saved) >= BULK_MAX_FILES:
+                entry.update(status="skipped", error=f"More than {BULK_MAX_FILES} files")
+                continue
+            seen.add(filename)
+            size, content_hash = _save_stream(stream, os.path.join(staging, filename), budget)
+            budget -= size
+            saved.append((entry, filename, size, content_hash))
+    except zipfile.BadZipFile:
+        return jsonify({"msg": "Archive is not a valid zip file"}), 400
+    except ValueError as e:
+        return jsonify({"msg": str(e)}), 413
+
+    futures = {_extract_executor.submit(_extract_bulk_file, os.path.join(staging, item[1])): item
+               for item in saved}
+    extracted = []
+    for future in as_completed(futures):
+        entry, filename, size, content_hash = futures[future]
+        try:
+            pages = future.result()
+        except Exception as e:
+            entry.update(status="failed", error=f"Failed to extract text from PDF: {e}")
+            continue
+        if not any(page['text'].strip() for page in pages):
+            entry.update(status="failed", error="PDF appears to be empty or unreadable")
+            continue
+        record = PdfData(filename=filename, user_id=user_id, pdf_size=f"{size / 1024:.1f} KB",
+                         file_type='pdf', content_hash=content_hash)
+        extracted.append((entry, record, pages))
+
+    reserved = []
+    try:
+        for entry, record, _ in extracted:
+            # Staged under the uploaded name, stored under a free one
+            staged_name = record.filename
+            record.filename, path = reserve_upload(staged_name)
+            reserved.append((os.path.join(staging, staged_name), path))
+            entry["filename"] = record.filename
+        db.session.add_all([record for _, record, _ in extracted])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        for _, path in reserved:
+            _discard(path)
+        traceback.print_exc()
+        return jsonify({"msg": "Database error", "error": str(e), "files": report}), 500
+
+    jobs = {}
+    for (entry, record, pages), (staged, path) in zip(extracted, reserved):
+        os.replace(staged, path)
+        reset_document(user_id, record.id)
+        entry.update(status="uploaded", pdf_id=record.id)
+        jobs[_ingest_executor.submit(_embed_document, record.id, user_id, pages)] = entry
+    for future in as_completed(jobs):
+        try:
+            future.result()
+        except Exception as e:
+            # The file and row are kept; the QA index is still built on first question
+            jobs[future].update(warning=f"Embedding failed: {e}")
+
+    uploaded = sum(1 for entry in report if entry.get("status") == "uploaded")
+    return jsonify({
+        "msg": f"{uploaded} of {len(report)} files uploaded",
+        "files": report,
+    }), 201 if uploaded else 400
+
+
 os.environ['TESSDATA_PREFIX'] = r"C:\Program Files\Tesseract-OCR\tessdata"
 
 # pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
@@ -132,24 +378,29 @@ def upload_image():
         print(f"[UPLOAD_IMAGE] Invalid file extension: {image.filename}", file=sys.stderr)
         return jsonify({"msg": "Only image files are allowed"}), 400
 
-    filename = secure_filename(image.filename)
-    image_path = os.path.join(UPLOAD_FOLDER, filename)
-    print(f"[UPLOAD_IMAGE] Saving image to: {image_path}", file=sys.stderr)
-
+    image_path = None
     try:
+        filename, image_path = reserve_upload(secure_filename(image.filename))
+        print(f"[UPLOAD_IMAGE] Saving image to: {image_path}", file=sys.stderr)
         image.save(image_path)
         img_size = f"{os.path.getsize(image_path) / 1024:.1f} KB"
+        content_hash = file_sha256(image_path)
         print(f"[UPLOAD_IMAGE] Image saved: {image_path}", file=sys.stderr)
-        img = Image.open(image_path)
-        reader = easyocr.Reader(['en'])   
         print(f"[UPLOAD_IMAGE] Image opened for OCR", file=sys.stderr)
-        text = ' '.join([t[1] for t in reader.readtext(np.array(img))])
+        with scheduler.slot('ocr'):
+            text = read_image_text(image_path)
         print(f"[UPLOAD_IMAGE] OCR text length: {len(text)}", file=sys.stderr)
         if not text.strip():
             print("[UPLOAD_IMAGE] No text detected in the image", file=sys.stderr)
+            _discard(image_path)
             return jsonify({"msg": "No text detected in the image"}), 400
+    except Overloaded:
+        _discard(image_path)
+        raise
     except Exception as e:
         print(f"[UPLOAD_IMAGE] Failed to process image: {e}", file=sys.stderr)
+        if image_path:
+            _discard(image_path)
         return jsonify({"msg": "Failed to process image", "error": str(e)}), 500
 
     user_id_str = get_jwt_identity()
@@ -158,22 +409,25 @@ def upload_image():
         user_id = int(user_id_str)
     except (ValueError, TypeError):
         print("[UPLOAD_IMAGE] Invalid user identity", file=sys.stderr)
+        _discard(image_path)
         return jsonify({"msg": "Invalid user identity"}), 401
 
     user = User.query.get(user_id)
     print(f"[UPLOAD_IMAGE] User lookup: {user}", file=sys.stderr)
     if not user:
         print("[UPLOAD_IMAGE] User not found", file=sys.stderr)
+        _discard(image_path)
         return jsonify({"msg": "User not found"}), 404
 
     try:
-        ocr_record = PdfData(filename=filename, user_id=user_id, pdf_size=img_size, file_type='image')
+        ocr_record = PdfData(filename=filename, user_id=user_id, pdf_size=img_size, file_type='image', content_hash=content_hash)
         db.session.add(ocr_record)
         db.session.commit()
         print(f"[UPLOAD_IMAGE] DB commit successful, ocr_id: {ocr_record.id}", file=sys.stderr)
     except Exception as e:
         db.session.rollback()
         print(f"[UPLOAD_IMAGE] Database error: {e}", file=sys.stderr)
+        _discard(image_path)
         return jsonify({"msg": "Database error", "error": str(e)}), 500
 
     print("[UPLOAD_IMAGE] Success", file=sys.stderr)
@@ -186,52 +440,132 @@ def upload_image():
 
 
 
+DOCUMENTS_PAGE_SIZE = 50
+DOCUMENTS_MAX_PAGE_SIZE = 200
+# Columns that are only loaded when asked for through ?fields=
+DOCUMENT_OPTIONAL_FIELDS = {'summary'}
+
+
+def _encode_cursor(pdf):
+    raw = f"{pdf.created_at.isoformat()}|{pdf.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    created_at, pdf_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+    return datetime.fromisoformat(created_at), int(pdf_id)
+
+
 @pdf_bp.route('/documents', methods=['GET'])
 @jwt_required()
 def get_document():
+    """
+    List the user's documents, newest first, one keyset page at a time.
+    Query params: ``limit``, ``cursor`` (the ``next_cursor`` of the previous
+    page) and ``fields`` (comma separated extras, e.g. ``summary``).
+    """
     user_id = get_jwt_identity()
+    fields = {f.strip() for f in request.args.get('fields', '').split(',') if f.strip()}
+    if fields - DOCUMENT_OPTIONAL_FIELDS:
+        return jsonify({"msg": f"Unknown fields: {', '.join(sorted(fields - DOCUMENT_OPTIONAL_FIELDS))}"}), 400
+    limit = min(request.args.get('limit', DOCUMENTS_PAGE_SIZE, type=int), DOCUMENTS_MAX_PAGE_SIZE)
+    if limit < 1:
+        return jsonify({"msg": "limit must be positive"}), 400
+    cursor = request.args.get('cursor')
     try:
-        pdfs = PdfData.query.filter_by(user_id=user_id).all()
-        if not pdfs:
+        query = PdfData.query.filter_by(user_id=user_id)
+        if 'summary' not in fields:
+            query = query.options(defer(PdfData.summary))
+        if cursor:
+            try:
+                cursor_created_at, cursor_id = _decode_cursor(cursor)
+            except Exception:
+                return jsonify({"msg": "Invalid cursor"}), 400
+            query = query.filter(or_(
+                PdfData.created_at < cursor_created_at,
+                and_(PdfData.created_at == cursor_created_at, PdfData.id < cursor_id),
+            ))
+        pdfs = query.order_by(PdfData.created_at.desc(), PdfData.id.desc()).limit(limit + 1).all()
+        if not pdfs and not cursor:
             return jsonify({"msg": "No PDFs found for this user"}), 404
-        data =[{
-            "id": pdf.id,
-            "filename": pdf.filename,
-            "uploaded_at": pdf.uploaded_at.isoformat(),
-            "created_at": pdf.created_at.isoformat(),
-            "pdf_size": pdf.pdf_size,
-            "summary": pdf.summary if pdf.summary else "",  
-        } for pdf in pdfs
-        ]   
-
-        return jsonify({"document":data}), 200
+        has_more = len(pdfs) > limit
+        pdfs = pdfs[:limit]
+        data = []
+        for pdf in pdfs:
+            doc = {
+                "id": pdf.id,
+                "filename": pdf.filename,
+                "uploaded_at": pdf.uploaded_at.isoformat(),
+                "created_at": pdf.created_at.isoformat(),
+                "pdf_size": pdf.pdf_size,
+            }
+            if 'summary' in fields:
+                doc["summary"] = pdf.summary if pdf.summary else ""
+            data.append(doc)
+
+        response = jsonify({
+            "document": data,
+            "next_cursor": _encode_cursor(pdfs[-1]) if has_more else None,
+        })
+        response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+        response.headers['Cache-Control'] = 'private, no-cache'
+        response.vary.add('Authorization')
+        return response.make_conditional(request)
     except Exception as e:
         print(f"Error retrieving documents: {e}")
         return jsonify({"msg": "Error retrieving documents", "error": str(e)}), 500
     
 
 
-from flask import send_from_directory
-
 @pdf_bp.route('/download/<int:pdf_id>', methods=['GET'])
 @jwt_required()
 def download_pdf(pdf_id):
+    """
+    Serve the stored file with a strong ETag (the SHA-256 recorded at upload)
+    and Range/If-Range support. The URL is not content-addressed, so clients
+    revalidate every time (no-cache) and get a 304 while the ETag still
+    matches. With DOWNLOAD_OFFLOAD set, the front proxy sends the bytes and
+    this worker only checks access.
+    """
     user_id = get_jwt_identity()
     pdf = PdfData.query.filter_by(id=pdf_id, user_id=user_id).first()
     if not pdf:
         return jsonify({"msg": "PDF not found"}), 404
     file_path = os.path.join(UPLOAD_FOLDER, pdf.filename)
-    if not os.path.exists(file_path):
-        return jsonify({"msg": "File not found"}), 404
-    print(f"Download request for: {file_path}, exists: {os.path.exists(file_path)}")
-    return send_from_directory(UPLOAD_FOLDER, pdf.filename, as_attachment=True)
-
+    # Uploads never replace another document's file (reserve_upload), so the
+    # recorded hash is the file's. Rows from before content hashing fall back
+    # to the size/mtime ETag of send_file, or nginx's own.
+    etag = pdf.content_hash
+
+    if current_app.config['DOWNLOAD_OFFLOAD'] == 'x-accel-redirect':
+        if not os.path.isfile(file_path):
+            return jsonify({"msg": "File not found"}), 404
+        # nginx answers Range requests itself from the internal location
+        # nginx keeps this Content-Type when it follows X-Accel-Redirect
+        mimetype = mimetypes.guess_type(pdf.filename)[0] or 'application/octet-stream'
+        response = current_app.response_class(mimetype=mimetype)
+        response.headers['X-Accel-Redirect'] = current_app.config['DOWNLOAD_ACCEL_PREFIX'] + quote(pdf.filename)
+        response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(pdf.filename)}"
+        if etag:
+            response.set_etag(etag)
+            response = response.make_conditional(request)
+    else:
+        # send_file emits X-Sendfile itself when USE_X_SENDFILE is on
+        try:
+            response = send_file(file_path, as_attachment=True, download_name=pdf.filename,
+                                 etag=etag or True, conditional=True, max_age=None)
+        except FileNotFoundError:
+            return jsonify({"msg": "File not found"}), 404
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.cache_control.max_age = None
+    response.expires = None
+    response.vary.add('Authorization')
+    return response
 
 
-    
 
-OPENROUTER_API_KEY = os.getenv('APIKEY')
-OPENROUTER_API_URL = 'https://openrouter.ai/api/v1/chat/completions'
 
 @pdf_bp.route('/summarize', methods=['POST'])
 @jwt_required()
@@ -255,29 +589,19 @@ def summarize_pdf():
         is_image = pdf.file_type == 'image'
 
         if is_image:
-            img = Image.open(file_path)
-            reader = easyocr.Reader(['en'])
-            content = ' '.join([t[1] for t in reader.readtext(np.array(img))])
+            with scheduler.slot('ocr'):
+                content = read_image_text(file_path)
         else:
-            content = extract_text(file_path)
+            # Takes its own 'extract' and 'ocr' slots
+            content = extract_document_text(file_path)
+    except Overloaded:
+        raise
     except Exception as e:
         return jsonify({'error': 'Failed to extract text from PDF', 'details': str(e)}), 500
-    prompt = f"Summarize the following research paper in a short paragraph. Then, list 3-5 key points and highlight the most important sentences.\n\nPaper:\n{content[:4000]}"
-    headers = {
-        'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-        'Content-Type': 'application/json',
-    }
-    payload = {
-        'model': 'openai/gpt-3.5-turbo',
-        'messages': [
-            {'role': 'system', 'content': 'You are a helpful research assistant.'},
-            {'role': 'user', 'content': prompt}
-        ]
-    }
     try:
-        resp = requests.post(OPENROUTER_API_URL, headers=headers, json=payload)
-        resp.raise_for_status()
-        summary = resp.json()['choices'][0]['message']['content']
+        # Long papers are summarized section by section, see services/summarize.py
+        # Section prompts are sent concurrently, on a loop for this call only
+        summary = asyncio.run(summarize_content(content))
         pdf.summary = summary
         db.session.commit()
         return jsonify({'summary': summary}), 200
@@ -301,11 +625,13 @@ def extract_entities():
 
         is_image = pdf.file_type == 'image'
         if is_image:
-            img = Image.open(file_path)
-            reader =  easyocr.Reader(['en'])
-            content = ' '.join([t[1] for t in reader.readtext(np.array(img))])
+            with scheduler.slot('ocr'):
+                content = read_image_text(file_path)
         else:
-            content = extract_text(file_path)
+            # Takes its own 'extract' and 'ocr' slots
+            content = extract_document_text(file_path)
+    except Overloaded:
+        raise
     except Exception as e:
         print(f"Error extracting text: {e}")
         return jsonify({'error': 'Failed to extract text from PDF', 'details': str(e)}), 500
@@ -315,21 +641,8 @@ def extract_entities():
         "and 'edges' (relationships). Each node should have an 'id' and 'label'. Each edge should have "
         "'source', 'target', and 'label'.\n\nPaper:\n" + content[:4000]
     )
-    headers = {
-        'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-        'Content-Type': 'application/json',
-    }
-    payload = {
-        'model': 'openai/gpt-3.5-turbo',
-        'messages': [
-            {'role': 'system', 'content': 'You are a helpful research assistant.'},
-            {'role': 'user', 'content': prompt}
-        ]
-    }
     try:
-        resp = requests.post(OPENROUTER_API_URL, headers=headers, json=payload)
-        resp.raise_for_status()
-        entities = resp.json()['choices'][0]['message']['content']
+        entities = chat_completion(prompt)
 
         try:
             entities = json.loads(entities)
@@ -358,7 +671,54 @@ def delete_pdf(pdf_id):
             os.remove(file_path)
         db.session.delete(pdf)
         db.session.commit()
-        return jsonify({'msg': 'PDF deleted successfully'}), 200
     except Exception as e:
         db.session.rollback()
-        return jsonify({'msg': 'Failed to delete PDF', 'error': str(e)}), 500
\ No newline at end of file
+        return jsonify({'msg': 'Failed to delete PDF', 'error': str(e)}), 500
+    try:
+        remove_document(pdf_id, user_id)
+    except Exception as e:
+        # The document is gone either way; `pdf index-check --fix` removes the leftover index
+        print(f"Failed to remove index for deleted PDF {pdf_id}: {e}")
+    return jsonify({'msg': 'PDF deleted successfully'}), 200
+
+
+@pdf_bp.cli.command('index-check')
+@click.option('--fix', is_flag=True, help='Remove index data for documents that no longer exist.')
+def index_check(fix):
+    """Compare PdfData rows with the per-document FAISS indexes."""
+    report = check_consistency(pdf_id for (pdf_id,) in db.session.query(PdfData.id))
+    for key, ids in report.items():
+        click.echo(f"{key}: {len(ids)} {ids[:20]}")
+    if fix:
+        for pdf_id in report["orphaned_indexes"]:
+            remove_document(pdf_id)
+        click.echo("Removed orphaned index data")
+
+
+@pdf_bp.cli.command('reindex')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Worker processes.')
+@click.option('--threads', default=1, show_default=True, help='torch threads per worker process.')
+@click.option('--force', is_flag=True, help='Rebuild documents that already have a current index.')
+@click.option('--checkpoint', default=CHECKPOINT_PATH, show_default=True, help='Progress file used to resume.')
+@click.option('--prune', is_flag=True, help='Delete older index versions once every document is rebuilt.')
+def reindex_command(workers, threads, force, checkpoint, prune):
+    """Rebuild text, chunks and indexes for every document at the current model/chunker version."""
+    documents = []
+    for pdf_id, user_id, filename, file_type in db.session.query(PdfData.id, PdfData.user_id, PdfData.filename, PdfData.file_type):
+        file_path = os.path.join(UPLOAD_FOLDER, filename)
+        if not os.path.isfile(file_path):
+            click.echo(f"{pdf_id}: file {filename} missing from uploads, skipped")
+            continue
+        documents.append((pdf_id, user_id, file_path, file_type == 'image'))
+    known = {os.path.basename(path) for _, _, path, _ in documents}
+    for name in sorted(set(os.listdir(UPLOAD_FOLDER)) - known):
+        click.echo(f"uploads/{name} has no PdfData row, skipped")
+
+    state = reindex(documents, workers, threads, checkpoint, force, echo=click.echo)
+    click.echo(f"Done: {len(state['done'])} indexed, {len(state['failed'])} failed")
+    if prune:
+        if state['failed']:
+            click.echo("Not pruning: some documents failed")
+        else:
+            prune_versions()
+            click.echo(f"Removed index versions other than {INDEX_VERSION}")
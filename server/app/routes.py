@@ -1,18 +1,20 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from .models import PdfData, ChatHistory
-import faiss
-from sentence_transformers import SentenceTransformer
-import numpy as np
-import requests
-from pdfminer.high_level import extract_text
 import os
 import json
+import asyncio
+import httpx
 from dotenv import load_dotenv
 from .pdf import UPLOAD_FOLDER
 from . import db
-import easyocr
-from PIL import Image
+from .services.chunker import chunk_pages
+from .services.embedding import get_embedding_model
+from .services.extraction import extract_pages
+from .services.index_store import open_document, search_document
+from .services.llm import chat_completion, chat_completion_async, wait_executor
+from .services.scheduler import scheduler, Overloaded
+from .services.share_cache import get_share, parse_token, format_token
 
 
 
@@ -20,15 +22,136 @@ load_dotenv()
 qa_bp = Blueprint('qa', __name__)
 
 
-embedder = SentenceTransformer('all-MiniLM-L6-v2')
+# Whitelist of free models
+ALLOWED_MODELS = [
+    'openai/gpt-3.5-turbo',
+    'google/gemini-pro',
+    'anthropic/claude-3-haiku',
+    'meta-llama/llama-3-8b-instruct',
+]
+
+STYLE_MAP = {
+    "concise": "Be concise and to the point.",
+    "technical": "Use technical language and detailed explanations.",
+    "casual": "Be casual and friendly."
+}
+
+TOP_K = 3
+# Multi-document questions: total passages in the prompt, and the guaranteed
+# minimum / allowed maximum taken from any one document
+MULTI_DOC_MAX_DOCUMENTS = 10
+MULTI_DOC_TOP_K = 8
+MULTI_DOC_MIN_PER_DOC = 1
+MULTI_DOC_MAX_PER_DOC = 3
+BATCH_MAX_QUESTIONS = 50
+# Concurrent LLM calls per batch request, overridable per request up to the max
+BATCH_FANOUT = int(os.getenv('BATCH_FANOUT', '5'))
+BATCH_MAX_FANOUT = int(os.getenv('BATCH_MAX_FANOUT', '20'))
+
+
+def chunk_loader(pdf):
+    file_path = os.path.join(UPLOAD_FOLDER, pdf.filename)
+    is_image = pdf.filename.lower().endswith(('.png', '.jpg', '.jpeg'))
+    return lambda: chunk_pages(extract_pages(file_path, is_image))
+
+
+def query_embedder(texts):
+    """``embed(model)`` -> ``texts`` encoded with that model, each model encoded once under a 'qa' slot."""
+    vectors = {}
+
+    def embed(model):
+        if model not in vectors:
+            with scheduler.slot('qa'):
+                vectors[model] = get_embedding_model(model).encode(texts).astype('float32')
+        return vectors[model]
+    return embed
+
+
+def search_with_retry(user_id, pdf, doc, embed, k):
+    """
+    search_document for one document. The vector service answers 409 when
+    the index was rebuilt with another model since ``doc`` was opened; the
+    document is then re-opened and searched once more with the new model.
+    """
+    try:
+        return search_document(doc, embed(doc.model), k)
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code != 409:
+            raise
+    doc = open_document(user_id, pdf.id, chunk_loader(pdf))
+    return search_document(doc, embed(doc.model), k)
+
+
+def merge_hits(per_doc_hits, top_k, min_per_doc, max_per_doc):
+    """
+    Merge per-document ``(distance, pdf, chunk)`` hit lists, each sorted by
+    distance. Every document first gets its ``min_per_doc`` best passages, the
+    remaining slots go to the closest passages overall, and no document
+    contributes more than ``max_per_doc``. Returned in distance order.
+    """
+    selected = []
+    rest = []
+    for hits in per_doc_hits:
+        selected.extend(hits[:min_per_doc])
+        rest.extend(hits[min_per_doc:max_per_doc])
+    rest.sort(key=lambda hit: hit[0])
+    selected.extend(rest[:max(top_k - len(selected), 0)])
+    selected.sort(key=lambda hit: hit[0])
+    return selected
+
+
+def format_context(hits):
+    parts = []
+    for n, (_, pdf, chunk) in enumerate(hits, start=1):
+        where = f"{pdf.filename}, page {chunk['page']}" if chunk.get('page') else pdf.filename
+        parts.append(f"[{n}] {where}:\n{chunk['text']}")
+    return '\n\n'.join(parts)
+
+
+def format_sources(hits):
+    return [
+        {'ref': n, 'pdf_id': pdf.id, 'filename': pdf.filename, 'page': chunk.get('page'),
+         'source': chunk.get('source', 'text'), 'ocr_confidence': chunk.get('confidence')}
+        for n, (_, pdf, chunk) in enumerate(hits, start=1)
+    ]
+
+
+def build_prompt(question, context, prompt_style, cite=False):
+    style_instruction = STYLE_MAP.get(prompt_style, "")
+    if cite:
+        style_instruction += "\nThe context comes from several documents. Cite the passages you use as [n]."
+    return f"{style_instruction}\nContext: {context}\n\nQuestion: {question}\n\nAnswer:"
 
 
-OPENROUTER_API_KEY = os.getenv('APIKEY')
-OPENROUTER_API_URL = 'https://openrouter.ai/api/v1/chat/completions'
+def make_turn(question, answer, llm_model):
+    return [
+        {
+            "role": "user",
+            "content": question,
+            "model": llm_model,
+            "type": "user"
+        },
+        {
+            "role": "assistant",
+            "content": answer,
+            "model": llm_model,
+            "type": "assistant"
+        }
+    ]
+
+
+def append_history(user_id, turns):
+    """Append messages to the user's chat history in a single write."""
+    history = ChatHistory.query.filter_by(user_id=user_id).first()
+    if history:
+        msgs = json.loads(history.messages or "[]")
+        msgs.extend(turns)
+        history.messages = json.dumps(msgs)
+    else:
+        history = ChatHistory(user_id=user_id, messages=json.dumps(turns))
+        db.session.add(history)
+    db.session.commit()
 
-# In-memory FAISS index for demo (should persist in production)
-pdf_faiss_indexes = {}
-pdf_text_chunks = {}
 
 @qa_bp.route('/ask', methods=['POST'])
 @jwt_required()
@@ -36,135 +159,176 @@ def ask_question():
     data = request.get_json()
     question = data.get('question')
     pdf_id = data.get('pdf_id')
+    # A list of pdf_ids asks across several documents at once
+    pdf_ids = data.get('pdf_ids') or ([pdf_id] if pdf_id else [])
     user_id = get_jwt_identity()
     llm_model = data.get('llm_model', 'openai/gpt-3.5-turbo')
     prompt_style = data.get('prompt_style', 'concise')
 
     
 
-    print(f"[DEBUG] User {user_id} is asking question: {question} for PDF ID: {pdf_id} using model: {llm_model} with style: {prompt_style}")
-    # Whitelist of free models
-    allowed_models = [
-        'openai/gpt-3.5-turbo',
-        'google/gemini-pro',
-        'anthropic/claude-3-haiku',
-        'meta-llama/llama-3-8b-instruct',
-    ]
-    if llm_model not in allowed_models:
+    print(f"[DEBUG] User {user_id} is asking question: {question} for PDF IDs: {pdf_ids} using model: {llm_model} with style: {prompt_style}")
+    if llm_model not in ALLOWED_MODELS:
         return jsonify({'error': 'Selected LLM model is not allowed. Please choose a free model.'}), 400
 
 
-    if not question or not pdf_id:
+    if not question or not pdf_ids:
         return jsonify({'error': 'Missing question or pdf_id'}), 400
+    if not isinstance(pdf_ids, list) or len(pdf_ids) > MULTI_DOC_MAX_DOCUMENTS:
+        return jsonify({'error': f'pdf_ids must be a list of at most {MULTI_DOC_MAX_DOCUMENTS} ids'}), 400
+    try:
+        pdf_ids = list(dict.fromkeys(int(i) for i in pdf_ids))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid pdf_ids'}), 400
 
-    pdf = PdfData.query.filter_by(id=pdf_id, user_id=user_id).first()
-    if not pdf:
+    pdfs = PdfData.query.filter(PdfData.user_id == user_id, PdfData.id.in_(pdf_ids)).all()
+    if len(pdfs) != len(pdf_ids):
         return jsonify({'error': 'PDF not found'}), 404
 
-    file_path = os.path.join(UPLOAD_FOLDER, pdf.filename)
+    # Index is built once per document and shared with other workers through
+    # mmap, or held by the user's vector service shard
+    try:
+        indexes = list(wait_executor.map(
+            lambda pdf: open_document(user_id, pdf.id, chunk_loader(pdf)), pdfs))
+    except Overloaded:
+        raise
+    except Exception as e:
+        print("debug entered except", e)
+        return jsonify({'error': 'Failed to extract text from document', 'details': str(e)}), 500
 
+    multi = len(pdfs) > 1
+    top_k = MULTI_DOC_TOP_K if multi else TOP_K
+    max_per_doc = MULTI_DOC_MAX_PER_DOC if multi else TOP_K
 
+    # Embed the question once per embedding model in use (more than one only
+    # while documents are being re-indexed), then search every index in parallel
+    embed = query_embedder([question])
+    for model in {doc.model for doc in indexes}:
+        embed(model)
 
-    is_image = pdf.filename.lower().endswith(('.png', '.jpg', '.jpeg'))
+    def search(pdf, doc):
+        hits = search_with_retry(user_id, pdf, doc, embed, max_per_doc)[0]
+        return [(d, pdf, chunk) for d, chunk in hits]
 
+    try:
+        per_doc_hits = list(wait_executor.map(search, pdfs, indexes))
+    except httpx.HTTPError as e:
+        # Overloaded is not an HTTPError, so a full 'qa' queue still gives 429
+        return jsonify({'error': 'Vector search failed', 'details': str(e)}), 500
+    hits = merge_hits(per_doc_hits, top_k, MULTI_DOC_MIN_PER_DOC, max_per_doc)
+    context = format_context(hits)
 
-    # Split PDF content into chunks (simple split, improve as needed)
+    # Call OpenRouter API
+    prompt = build_prompt(question, context, prompt_style, cite=multi)
     try:
-        if is_image:
-            # Use EasyOCR for images
-            reader = easyocr.Reader(['en'])
-            img = Image.open(file_path)
-            content = ' '.join([t[1] for t in reader.readtext(np.array(img))])
-        else:
-            # Use pdfminer for PDFs
-            content = extract_text(file_path)
+        answer = chat_completion(prompt, llm_model)
     except Exception as e:
-        print("debug entered except", e)
-        return jsonify({'error': f'Failed to extract text from {"image" if is_image else "PDF"}', 'details': str(e)}), 500
-    
+        return jsonify({'error': 'LLM call failed', 'details': str(e)}), 500
     
-    chunk_size = 500  # characters
-    chunks = [content[i:i+chunk_size] for i in range(0, len(content), chunk_size)]
-
-    # Build FAISS index if not already built
-    if pdf_id not in pdf_faiss_indexes:
-        embeddings = embedder.encode(chunks)
-        index = faiss.IndexFlatL2(embeddings.shape[1])
-        index.add(np.array(embeddings).astype('float32'))
-        pdf_faiss_indexes[pdf_id] = index
-        pdf_text_chunks[pdf_id] = chunks
-    else:
-        index = pdf_faiss_indexes[pdf_id]
-        chunks = pdf_text_chunks[pdf_id]
+    new_turn = make_turn(question, answer, llm_model)
+    print(f"[DEBUG] New turn: {new_turn}")
+    append_history(user_id, new_turn)
 
-    # Embed the question and search
-    q_emb = embedder.encode([question]).astype('float32')
-    D, I = index.search(q_emb, 3)  # top 3 chunks
-    context = '\n'.join([chunks[i] for i in I[0]])
+    print(f"[DEBUG] Answer generated: {answer}")
+    return jsonify({'answer': answer, 'sources': format_sources(hits)})
 
-    style_map = {
-        "concise": "Be concise and to the point.",
-        "technical": "Use technical language and detailed explanations.",
-        "casual": "Be casual and friendly."
-    }
-    style_instruction = style_map.get(prompt_style, "")
 
-    # Call OpenRouter API
-    prompt = f"{style_instruction}\nContext: {context}\n\nQuestion: {question}\n\nAnswer:"
-    headers = {
-        'Authorization': f'Bearer {OPENROUTER_API_KEY}',
-        'Content-Type': 'application/json',
-    }
-    payload = {
-        'model':llm_model,  
-        'messages': [
-            {'role': 'system', 'content': 'You are a helpful research assistant.'},
-            {'role': 'user', 'content': prompt}
-        ]
-    }
+@qa_bp.route('/ask/batch', methods=['POST'])
+@jwt_required()
+def ask_batch():
+    """
+    Answer a list of questions against one document. The questions are
+    embedded in one encode call and searched in one FAISS query, then the LLM
+    calls run concurrently (``concurrency`` at a time). Each answer is streamed
+    back as an NDJSON line as soon as it finishes; the chat history is
+    appended once, in question order, after the last answer.
+    """
+    data = request.get_json()
+    questions = data.get('questions')
+    pdf_id = data.get('pdf_id')
+    user_id = get_jwt_identity()
+    llm_model = data.get('llm_model', 'openai/gpt-3.5-turbo')
+    prompt_style = data.get('prompt_style', 'concise')
+
+    if llm_model not in ALLOWED_MODELS:
+        return jsonify({'error': 'Selected LLM model is not allowed. Please choose a free model.'}), 400
+    if not pdf_id or not isinstance(questions, list) or not questions:
+        return jsonify({'error': 'Missing questions or pdf_id'}), 400
+    if not all(isinstance(q, str) and q.strip() for q in questions):
+        return jsonify({'error': 'Questions must be non-empty strings'}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({'error': f'At most {BATCH_MAX_QUESTIONS} questions per batch'}), 400
+    try:
+        fanout = max(1, min(int(data.get('concurrency', BATCH_FANOUT)), BATCH_MAX_FANOUT))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'concurrency must be an integer'}), 400
+
+    pdf = PdfData.query.filter_by(id=pdf_id, user_id=user_id).first()
+    if not pdf:
+        return jsonify({'error': 'PDF not found'}), 404
+
     try:
-        resp = requests.post(OPENROUTER_API_URL, headers=headers, json=payload)
-        resp.raise_for_status()
-        answer = resp.json()['choices'][0]['message']['content']
+        doc = open_document(user_id, pdf_id, chunk_loader(pdf))
+    except Overloaded:
+        raise
     except Exception as e:
-        return jsonify({'error': 'LLM call failed', 'details': str(e)}), 500
-    
-    new_turn = [
-    {
-        "role": "user",
-        "content": question,
-        "model": llm_model,
-        "type": "user"
-    },
-    {
-        "role": "assistant",
-        "content": answer,
-        "model": llm_model,
-        "type": "assistant"
-    }
-]
+        return jsonify({'error': 'Failed to extract text from document', 'details': str(e)}), 500
 
-    print(f"[DEBUG] New turn: {new_turn}")
-    history = ChatHistory.query.filter_by(user_id=user_id).first()
+    try:
+        results = search_with_retry(user_id, pdf, doc, query_embedder(questions), TOP_K)
+    except httpx.HTTPError as e:
+        return jsonify({'error': 'Vector search failed', 'details': str(e)}), 500
+    hits_per_question = [[(d, pdf, chunk) for d, chunk in row] for row in results]
+    prompts = [
+        build_prompt(question, format_context(hits), prompt_style)
+        for question, hits in zip(questions, hits_per_question)
+    ]
 
-    print("going")
-    if history:
-        print("entered ---------")
-        msgs = json.loads(history.messages or "[]")
-        print("msgs before extend:", msgs)
-        msgs.extend(new_turn)
-        print("msgs after extend:", msgs)
-        history.messages = json.dumps(msgs)
-        print(f"[DEBUG] Saving to DB: {json.dumps(msgs, indent=2)}")
-    else:
-        history = ChatHistory(user_id=user_id, messages=json.dumps(new_turn))
-        db.session.add(history)
+    def generate():
+        loop = asyncio.new_event_loop()
+        semaphore = asyncio.Semaphore(fanout)
 
-    db.session.commit()
-    # ⬆⬆⬆  LINES END HERE ⬆⬆⬆
+        async def answer_one(position, prompt):
+            async with semaphore:
+                try:
+                    return position, await chat_completion_async(prompt, llm_model), None
+                except Exception as e:
+                    return position, None, str(e)
 
-    print(f"[DEBUG] Answer generated: {answer}")
-    return jsonify({'answer': answer})
+        pending = {loop.create_task(answer_one(i, p)) for i, p in enumerate(prompts)}
+        answers = {}
+        try:
+            while pending:
+                done, pending = loop.run_until_complete(
+                    asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED))
+                for task in done:
+                    position, answer, error = task.result()
+                    line = {'index': position, 'question': questions[position]}
+                    if error is None:
+                        answers[position] = answer
+                        line['answer'] = answer
+                        line['sources'] = format_sources(hits_per_question[position])
+                    else:
+                        line['error'] = 'LLM call failed'
+                        line['details'] = error
+                    yield json.dumps(line) + '\n'
+        finally:
+            # Client went away mid-stream: drop the calls still queued
+            for task in pending:
+                task.cancel()
+            if pending:
+                loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+            # Saved even after a disconnect: these answers were streamed and paid for
+            turns = []
+            for position in sorted(answers):
+                turns.extend(make_turn(questions[position], answers[position], llm_model))
+            if turns:
+                append_history(user_id, turns)
+
+        yield json.dumps({'done': True, 'answered': len(answers), 'failed': len(questions) - len(answers)}) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
 
 
 # --- Chat History Endpoints ---
@@ -207,15 +371,39 @@ def answershare():
     share = Answershare(answer=answer)
     db.session.add(share)
     db.session.commit()
-    return jsonify({'url': f"http://localhost:3000/dashboard/shared/{share.token}"})
+    return jsonify({'url': f"http://localhost:3000/dashboard/shared/{format_token(share.token)}"})
+
+
+def load_share(key):
+    share = Answershare.query.filter_by(token=key).first()
+    if not share:
+        return None
+    return {'answer': share.answer, 'created_at': share.created_at.isoformat()}
 
 
 @qa_bp.route('/shared/<token>', methods=['GET'])
 def shared(token):
-    share = Answershare.query.filter_by(token=token).first_or_404()
-    if not share:
+    """
+    Public view of a shared answer. Shares never change, so the ETag is the
+    token itself: a revalidation gets 304 without any lookup, and other views
+    are served from the share cache before falling back to the database.
+    """
+    key = parse_token(token)
+    if key is None:
         return jsonify({'error': 'Invalid token'}), 404
-    return jsonify({'answer': share.answer, 'created_at': share.created_at.isoformat()})
+    etag = key.hex()
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        share = get_share(key, load_share)
+        if share is None:
+            return jsonify({'error': 'Invalid token'}), 404
+        response = jsonify(share)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = current_app.config['SHARE_MAX_AGE']
+    response.cache_control.immutable = True
+    return response
 
 
 
@@ -0,0 +1,149 @@
+import os
+import re
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+
+# Chunk size and overlap in tokens (see count_tokens). all-MiniLM-L6-v2 truncates
+# input at 256 word pieces, and technical text splits into noticeably more word
+# pieces than words, so the default leaves headroom.
+CHUNK_TOKENS = int(os.getenv('CHUNK_TOKENS', '160'))
+CHUNK_OVERLAP = int(os.getenv('CHUNK_OVERLAP', '32'))
+# Part of the index version: bump when the chunking logic changes so existing
+# indexes are rebuilt (services/reindex.py). Size and overlap are included, so
+# changing them through the environment versions indexes too.
+CHUNKER_VERSION = f"sent{CHUNK_TOKENS}o{CHUNK_OVERLAP}-v3"
+
+_TOKEN = re.compile(r"\w+|[^\w\s]")
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t\r\f\v]*\n\s*")
+_LINE_HYPHEN = re.compile(r"(\w)-\n(\w)")
+# End punctuation, optional closing quotes/brackets, whitespace, then something
+# that can start a sentence
+_SENTENCE_END = re.compile(r"[.!?][\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+# Words whose trailing period rarely ends a sentence
+_ABBREVIATIONS = {
+    'al', 'approx', 'cf', 'dr', 'e.g', 'eq', 'eqs', 'fig', 'figs', 'i.e', 'mr', 'mrs', 'ms',
+    'no', 'nos', 'p', 'pp', 'prof', 'ref', 'refs', 'sec', 'st', 'vol', 'vs',
+}
+
+
+def count_tokens(text: str) -> int:
+    """Words and punctuation marks; a cheap, deterministic stand-in for the model's tokenizer."""
+    return sum(1 for _ in _TOKEN.finditer(text))
+
+
+def _paragraphs(text: str) -> Iterator[str]:
+    start = 0
+    for match in _PARAGRAPH_BREAK.finditer(text):
+        yield text[start:match.start()]
+        start = match.end()
+    yield text[start:]
+
+
+def _sentences(paragraph: str) -> Iterator[str]:
+    start = 0
+    for match in _SENTENCE_END.finditer(paragraph):
+        word = paragraph[start:match.start()].rsplit(None, 1)[-1:] or ['']
+        word = word[0].lstrip('("\'[').lower()
+        if word in _ABBREVIATIONS or (len(word) == 1 and word.isalpha()):
+            continue
+        yield paragraph[start:match.end()]
+        start = match.end()
+    yield paragraph[start:]
+
+
+def _units(paragraph: str, max_tokens: int, count: Callable[[str], int]) -> Iterator[Tuple[str, int]]:
+    """Whitespace-normalized sentences with their token counts; longer-than-chunk sentences are cut at words."""
+    paragraph = _LINE_HYPHEN.sub(r"\1\2", paragraph)
+    for sentence in _sentences(paragraph):
+        words = sentence.split()
+        if not words:
+            continue
+        sentence = ' '.join(words)
+        tokens = count(sentence)
+        if tokens <= max_tokens:
+            yield sentence, tokens
+            continue
+        piece, size = [], 0
+        for word in words:
+            n = count(word)
+            if piece and size + n > max_tokens:
+                yield ' '.join(piece), size
+                piece, size = [], 0
+            piece.append(word)
+            size += n
+        if piece:
+            yield ' '.join(piece), size
+
+
+def _join(units: List[Tuple[str, int, bool]]) -> str:
+    parts = []
+    for i, (sentence, _, starts_paragraph) in enumerate(units):
+        if i:
+            parts.append('\n\n' if starts_paragraph else ' ')
+        parts.append(sentence)
+    return ''.join(parts)
+
+
+def _tail(units: List[Tuple[str, int, bool]], overlap: int) -> Tuple[List[Tuple[str, int, bool]], int]:
+    """The trailing whole sentences of a chunk that fit in ``overlap`` tokens."""
+    kept, size = [], 0
+    for unit in reversed(units):
+        if size + unit[1] > overlap:
+            break
+        kept.append(unit)
+        size += unit[1]
+    return kept[::-1], size
+
+
+def iter_text_chunks(text: str, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP,
+                     count: Callable[[str], int] = count_tokens) -> Iterator[str]:
+    """
+    Yield chunks of at most ``max_tokens`` tokens made of whole sentences.
+    A paragraph starts a new chunk when the current one is at least half
+    full and the paragraph would not fit; a chunk only breaks inside a
+    sentence when that sentence alone is too long. Each chunk repeats the
+    last whole sentences of the previous one, up to ``overlap`` tokens.
+    """
+    current, size, fresh = [], 0, 0
+    for paragraph in _paragraphs(text):
+        units = list(_units(paragraph, max_tokens, count))
+        if not units:
+            continue
+        paragraph_tokens = sum(n for _, n in units)
+        if fresh and size + paragraph_tokens > max_tokens and size >= max_tokens // 2:
+            yield _join(current)
+            (current, size), fresh = _tail(current, overlap), 0
+        for i, (sentence, n) in enumerate(units):
+            if fresh and size + n > max_tokens:
+                yield _join(current)
+                (current, size), fresh = _tail(current, overlap), 0
+            while current and size + n > max_tokens:
+                size -= current.pop(0)[1]
+            current.append((sentence, n, i == 0))
+            size += n
+            fresh += n
+    # A trailing run of pure overlap is already in the previous chunk
+    if fresh:
+        yield _join(current)
+
+
+def chunk_text(text: str, max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> List[str]:
+    if not isinstance(text, str):
+        raise ValueError("Input text must be a string.")
+    return list(iter_text_chunks(text, max_tokens, overlap))
+
+
+def iter_chunks(pages: Iterable[Dict], max_tokens: int = CHUNK_TOKENS,
+                overlap: int = CHUNK_OVERLAP) -> Iterator[Dict]:
+    """
+    Chunk pages (as returned by ``extract_pages``) one at a time, yielding
+    ``{'text', 'page', 'source', 'confidence'}`` dicts with 1-based page
+    numbers. Chunks never span pages, so every chunk cites exactly one.
+    """
+    for number, page in enumerate(pages, start=1):
+        for text in iter_text_chunks(page['text'], max_tokens, overlap):
+            yield {'text': text, 'page': number, 'source': page['source'], 'confidence': page['confidence']}
+
+
+def chunk_pages(pages: Iterable[Dict], max_tokens: int = CHUNK_TOKENS, overlap: int = CHUNK_OVERLAP) -> List[Dict]:
+    return list(iter_chunks(pages, max_tokens, overlap))
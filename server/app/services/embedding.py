@@ -1,24 +1,22 @@
 import requests
 import numpy as np
-import textwrap
 from typing import List, Union
 import faiss
 from sentence_transformers import SentenceTransformer
+from .index_store import EMBEDDING_MODEL_NAME
 
 
 
 OPENROUTER_API_KEY  = "key"
-embedding_model = SentenceTransformer("all-MiniLM-L6-v2")
+embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+# Other models are only loaded while old indexes built with them are still served
+_models = {EMBEDDING_MODEL_NAME: embedding_model}
 
 
-def chunk_text(text: str, max_chars: int = 1024) -> list[str]:
-    if not isinstance(text, str):
-        raise ValueError("Input text must be a string.")
-    try:
-        wrapped_text = textwrap.wrap(text, max_chars, break_long_words=False)
-        return wrapped_text
-    except Exception as e:
-        raise ValueError(f"Error wrapping text: {e}")
+def get_embedding_model(name: str = EMBEDDING_MODEL_NAME) -> SentenceTransformer:
+    if name not in _models:
+        _models[name] = SentenceTransformer(name)
+    return _models[name]
 
 
 def embed_text(text: Union[str, List[str]]) -> np.ndarray:
@@ -0,0 +1,100 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+from pdfminer.high_level import extract_pages as iter_layout_pages
+from pdfminer.layout import LTTextContainer
+import pypdfium2 as pdfium
+from .scheduler import scheduler
+
+
+# A page whose text layer has fewer non-whitespace characters than this is
+# treated as scanned and OCR'd instead
+OCR_MIN_CHARS = int(os.getenv('OCR_MIN_CHARS', '25'))
+OCR_DPI = int(os.getenv('OCR_DPI', '200'))
+# Pages OCR'd at once for one document; each page also takes an 'ocr' scheduler slot
+OCR_WORKERS = int(os.getenv('OCR_WORKERS', '2'))
+
+# PDFium is not thread-safe; rendering is cheap next to OCR, so it is serialized
+_pdfium_lock = threading.Lock()
+
+
+def _text_layer(file_path: str) -> List[str]:
+    return [
+        # Text boxes are roughly paragraphs; keep them apart for the chunker
+        '\n\n'.join(element.get_text().strip() for element in page if isinstance(element, LTTextContainer))
+        for page in iter_layout_pages(file_path)
+    ]
+
+
+def _ocr_pages(file_path: str, page_numbers: List[int]) -> Dict[int, tuple]:
+    """
+    OCR the given 0-based pages, OCR_WORKERS at a time. Rendering stays just
+    ahead of OCR so only a few page bitmaps are held in memory at once.
+    """
+    # Imported here so processes that only read text layers never load EasyOCR
+    from .ocr import read_image_result
+    in_flight = threading.BoundedSemaphore(OCR_WORKERS * 2)
+
+    def ocr(image):
+        try:
+            with scheduler.slot('ocr'):
+                return read_image_result(image)
+        finally:
+            in_flight.release()
+
+    futures = {}
+    with ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix='ocr') as pool:
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(file_path)
+        try:
+            for number in page_numbers:
+                in_flight.acquire()
+                with _pdfium_lock:
+                    image = pdf[number].render(scale=OCR_DPI / 72).to_pil()
+                futures[number] = pool.submit(ocr, image)
+        finally:
+            with _pdfium_lock:
+                pdf.close()
+    return {number: future.result() for number, future in futures.items()}
+
+
+def extract_text_layer(file_path: str) -> List[Dict]:
+    """
+    The pages' pdfminer text as ``{'text', 'source', 'confidence'}``, without
+    OCR. Safe to run in a process pool: it never loads the OCR model.
+    """
+    return [{'text': text, 'source': 'text', 'confidence': None} for text in _text_layer(file_path)]
+
+
+def ocr_scanned_pages(file_path: str, pages: List[Dict]) -> List[Dict]:
+    """Replace pages whose text layer is (nearly) empty with their OCR'd text, each under an 'ocr' slot."""
+    scanned = [i for i, page in enumerate(pages) if len(''.join(page['text'].split())) < OCR_MIN_CHARS]
+    if scanned:
+        pages = list(pages)
+        for number, (text, confidence) in _ocr_pages(file_path, scanned).items():
+            if text.strip():
+                pages[number] = {'text': text, 'source': 'ocr', 'confidence': confidence}
+    return pages
+
+
+def extract_pages(file_path: str, is_image: bool = False) -> List[Dict]:
+    """
+    Return the document's pages in order as ``{'text', 'source', 'confidence'}``.
+    Pages with a usable text layer come from pdfminer (``source='text'``); the
+    others are rasterized and OCR'd (``source='ocr'`` with EasyOCR's mean
+    confidence), so scanned and mixed PDFs are read in full. Takes its own
+    'extract' and 'ocr' scheduler slots, so don't call it while holding one.
+    """
+    if is_image:
+        from .ocr import read_image_result
+        with scheduler.slot('ocr'):
+            text, confidence = read_image_result(file_path)
+        return [{'text': text, 'source': 'ocr', 'confidence': confidence}]
+    with scheduler.slot('extract'):
+        pages = extract_text_layer(file_path)
+    return ocr_scanned_pages(file_path, pages)
+
+
+def extract_document_text(file_path: str, is_image: bool = False) -> str:
+    return '\n\n'.join(page['text'] for page in extract_pages(file_path, is_image))
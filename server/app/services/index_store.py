@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import threading
+from collections import namedtuple
+from typing import Callable, Dict, List, Optional, Set, Tuple
+import numpy as np
+import faiss
+from cachetools import LRUCache
+from .chunker import CHUNKER_VERSION
+from .scheduler import scheduler
+from .vector_client import VectorClient, RemoteDocument
+
+
+INDEX_FOLDER = os.getenv('INDEX_FOLDER', os.path.join(os.path.dirname(__file__), '..', '..', 'indexes'))
+os.makedirs(INDEX_FOLDER, exist_ok=True)
+
+# The embedding model new indexes are built with. Kept here rather than in
+# embedding.py so the vector service can use this module without loading it.
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+
+# Comma separated vector service URLs. When set, per-document indexes live in
+# those services (users sharded across them) instead of in this process.
+VECTOR_SERVICE_URLS = [url.strip() for url in os.getenv('VECTOR_SERVICE_URLS', '').split(',') if url.strip()]
+vector_client = VectorClient(VECTOR_SERVICE_URLS) if VECTOR_SERVICE_URLS else None
+
+# Indexes live in one folder per embedding model + chunker version. A new
+# version is built next to the old one (see services/reindex.py), and the old
+# index keeps answering until the document's new one is written.
+INDEX_VERSION = f"{EMBEDDING_MODEL_NAME}__{CHUNKER_VERSION}"
+# Indexes written before versioning sit directly in INDEX_FOLDER
+LEGACY_VERSION = ''
+
+# Flat codes are mapped straight from the index file, so every worker reading the
+# same document shares one copy in the page cache instead of holding its own.
+MMAP_FLAG = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+
+# ``model`` is the embedding model queries against this index must use
+DocumentIndex = namedtuple('DocumentIndex', ['index', 'chunks', 'model', 'version'])
+
+# Documents whose index each worker keeps open (chunks in memory, codes mapped).
+# Least recently asked about go first, which also releases documents deleted
+# through another worker.
+INDEX_CACHE_SIZE = int(os.getenv('INDEX_CACHE_SIZE', '256'))
+
+_indexes = LRUCache(maxsize=INDEX_CACHE_SIZE)
+_lock = threading.Lock()
+
+
+def _paths(pdf_id: int, version: str = INDEX_VERSION) -> Tuple[str, str]:
+    base = os.path.join(INDEX_FOLDER, version, str(pdf_id))
+    return base + '.faiss', base + '.json'
+
+
+def _created_path(version: str) -> str:
+    return os.path.join(INDEX_FOLDER, version, '.created')
+
+
+def _record_version(version: str) -> None:
+    """Write the version's creation time once. Directory mtimes can't order versions: deletes bump them."""
+    if os.path.exists(_created_path(version)):
+        return
+    try:
+        with open(_created_path(version), 'x', encoding='utf-8') as f:
+            f.write(str(time.time_ns()))
+    except FileExistsError:
+        pass
+
+
+def _created(version: str) -> Tuple[int, float]:
+    try:
+        with open(_created_path(version), encoding='utf-8') as f:
+            return int(f.read()), 0.0
+    except (FileNotFoundError, ValueError):
+        # Versions written before creation was recorded are older than any
+        # that have it; among themselves mtime is the best guess left
+        return 0, os.path.getmtime(os.path.join(INDEX_FOLDER, version))
+
+
+def index_versions() -> List[str]:
+    """All versions on disk, newest (by recorded creation) first, legacy last."""
+    dirs = [d for d in os.listdir(INDEX_FOLDER) if os.path.isdir(os.path.join(INDEX_FOLDER, d))]
+    dirs.sort(key=_created, reverse=True)
+    return dirs + [LEGACY_VERSION]
+
+
+def save_index(pdf_id: int, index: faiss.Index, chunks: List[Dict], version: str = INDEX_VERSION,
+               model: str = EMBEDDING_MODEL_NAME) -> None:
+    """
+    Write the index and its chunks (``{'text', 'page'}`` dicts, in index
+    order) next to each other. Files are written to a temporary name first
+    so other workers never map a half-written index.
+    """
+    index_path, chunks_path = _paths(pdf_id, version)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    if version:
+        _record_version(version)
+    faiss.write_index(index, index_path + '.tmp')
+    with open(chunks_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'model': model, 'chunks': chunks}, f)
+    os.replace(chunks_path + '.tmp', chunks_path)
+    os.replace(index_path + '.tmp', index_path)
+
+
+def load_index(pdf_id: int, version: str = INDEX_VERSION) -> Optional[DocumentIndex]:
+    index_path, chunks_path = _paths(pdf_id, version)
+    if not (os.path.exists(index_path) and os.path.exists(chunks_path)):
+        return None
+    index = faiss.read_index(index_path, MMAP_FLAG)
+    with open(chunks_path, encoding='utf-8') as f:
+        meta = json.load(f)
+    if isinstance(meta, list):
+        # Unversioned index: plain chunk list, built with the original model
+        meta = {'model': EMBEDDING_MODEL_NAME, 'chunks': meta}
+    # Indexes written before chunks carried their page number
+    chunks = [{'text': c, 'page': None} if isinstance(c, str) else c for c in meta['chunks']]
+    return DocumentIndex(index, chunks, meta['model'], version)
+
+
+def embed_chunks(chunks: List[Dict], workload: str = 'qa') -> np.ndarray:
+    from .embedding import get_embedding_model
+    with scheduler.slot(workload):
+        return np.array(get_embedding_model().encode([c['text'] for c in chunks])).astype('float32')
+
+
+def build_index(pdf_id: int, chunks: List[Dict], vectors: Optional[np.ndarray] = None,
+                model: str = EMBEDDING_MODEL_NAME) -> DocumentIndex:
+    if vectors is None:
+        vectors = embed_chunks(chunks)
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(np.asarray(vectors, dtype='float32'))
+    save_index(pdf_id, index, chunks, model=model)
+    # Re-open through mmap so this worker's copy is shared as well
+    return load_index(pdf_id)
+
+
+def _stamp(pdf_id: int, version: str = INDEX_VERSION) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(_paths(pdf_id, version)[0])
+    except FileNotFoundError:
+        return None
+    return st.st_ino, st.st_mtime_ns
+
+
+def _cache(pdf_id: int, entry: DocumentIndex) -> DocumentIndex:
+    with _lock:
+        _indexes[pdf_id] = (entry, _stamp(pdf_id, entry.version))
+    return entry
+
+
+def get_index(pdf_id: int, load_chunks: Callable[[], List[Dict]]) -> DocumentIndex:
+    """
+    Return a document's index, looking in this worker's cache, then on disk,
+    and only calling ``load_chunks`` to build it on a miss. The current
+    version is preferred; until it exists an older version is served (with
+    the model it was built with). Cached entries are checked against the
+    file on disk, so an index another worker dropped or rebuilt (e.g. after
+    its pdf_id was reused) is not served.
+    """
+    pdf_id = int(pdf_id)
+    current = _stamp(pdf_id)
+    with _lock:
+        cached = _indexes.get(pdf_id)
+    if cached and cached[0].version == INDEX_VERSION and current is not None and cached[1] == current:
+        return cached[0]
+    if current is not None:
+        entry = load_index(pdf_id)
+        if entry is not None:
+            return _cache(pdf_id, entry)
+    if cached and cached[1] is not None and cached[1] == _stamp(pdf_id, cached[0].version):
+        return cached[0]
+    for version in index_versions():
+        if version != INDEX_VERSION:
+            entry = load_index(pdf_id, version)
+            if entry is not None:
+                return _cache(pdf_id, entry)
+    return _cache(pdf_id, build_index(pdf_id, load_chunks()))
+
+
+def drop_index(pdf_id: int) -> None:
+    pdf_id = int(pdf_id)
+    with _lock:
+        _indexes.pop(pdf_id, None)
+    for version in index_versions():
+        for path in _paths(pdf_id, version):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def indexed_documents(version: Optional[str] = None) -> Set[int]:
+    """pdf_ids with an index on disk, in ``version`` or in any version."""
+    found = set()
+    for v in ([version] if version is not None else index_versions()):
+        folder = os.path.join(INDEX_FOLDER, v)
+        if not os.path.isdir(folder):
+            continue
+        found.update(int(name[:-len('.faiss')]) for name in os.listdir(folder)
+                     if name.endswith('.faiss') and name[:-len('.faiss')].isdigit())
+    return found
+
+
+def open_document(user_id: int, pdf_id: int, load_chunks: Callable[[], List[Dict]]):
+    """
+    Return a handle for searching one document, building its index from
+    ``load_chunks()`` if there is none. Local mode returns a DocumentIndex;
+    with VECTOR_SERVICE_URLS set, a RemoteDocument on the user's shard.
+    Either way ``handle.model`` is the model to embed queries with.
+    Takes its own scheduler slot only for embedding, so don't call it while
+    holding one: in remote mode it mostly waits on the vector service.
+    """
+    if vector_client is None:
+        return get_index(pdf_id, load_chunks)
+    url = vector_client.shard(user_id)
+    info = vector_client.info(url, pdf_id)
+    if info is None:
+        chunks = load_chunks()
+        info = vector_client.add(url, pdf_id, chunks, embed_chunks(chunks), EMBEDDING_MODEL_NAME)
+    return RemoteDocument(int(pdf_id), url, info['model'], info['version'])
+
+
+def search_document(handle, queries: np.ndarray, k: int) -> List[List[Tuple[float, Dict]]]:
+    """
+    ``(distance, chunk)`` hits for each query row, nearest first. A local
+    search takes a 'qa' slot; a remote one only waits on the service.
+    """
+    if isinstance(handle, RemoteDocument):
+        return vector_client.search(handle, queries, k)
+    with scheduler.slot('qa'):
+        D, I = handle.index.search(np.asarray(queries, dtype='float32'), k)
+    return [[(float(d), handle.chunks[i]) for d, i in zip(d_row, i_row) if i >= 0]
+            for d_row, i_row in zip(D, I)]
+
+
+def reset_document(user_id: int, pdf_id: int) -> None:
+    """Drop any index left under ``pdf_id`` (ids can be reused), locally and on the user's shard."""
+    drop_index(pdf_id)
+    if vector_client is not None:
+        vector_client.delete(pdf_id, vector_client.shard(user_id))
+
+
+def store_document(user_id: int, pdf_id: int, chunks: List[Dict], vectors: Optional[np.ndarray] = None) -> None:
+    """Build (or replace) a document's index at INDEX_VERSION, locally or on its shard."""
+    if not chunks:
+        return
+    if vector_client is None:
+        build_index(pdf_id, chunks, vectors)
+        return
+    if vectors is None:
+        vectors = embed_chunks(chunks)
+    vector_client.add(vector_client.shard(user_id), pdf_id, chunks, vectors, EMBEDDING_MODEL_NAME)
+
+
+def remove_document(pdf_id: int, user_id: Optional[int] = None) -> None:
+    """Drop a deleted document's index, locally and on its vector service shard."""
+    pdf_id = int(pdf_id)
+    drop_index(pdf_id)
+    if vector_client is not None:
+        # Without the owner we don't know the shard, so ask them all
+        vector_client.delete(pdf_id, None if user_id is None else vector_client.shard(user_id))
+
+
+def check_consistency(db_pdf_ids) -> Dict[str, List[int]]:
+    """
+    Compare the documents known to the database with what the indexes hold.
+    ``orphaned_indexes`` are indexed documents with no database row (safe to remove);
+    ``unindexed`` rows simply have not been queried yet and are built lazily.
+    """
+    db_pdf_ids = {int(i) for i in db_pdf_ids}
+    on_disk = indexed_documents() if vector_client is None else vector_client.documents()
+    return {
+        "orphaned_indexes": sorted(on_disk - db_pdf_ids),
+        "unindexed": sorted(db_pdf_ids - on_disk),
+    }
@@ -0,0 +1,87 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+from dotenv import load_dotenv
+from .scheduler import WORKLOADS
+
+load_dotenv()
+
+OPENROUTER_API_KEY = os.getenv('APIKEY')
+OPENROUTER_API_URL = 'https://openrouter.ai/api/v1/chat/completions'
+DEFAULT_MODEL = 'openai/gpt-3.5-turbo'
+SYSTEM_PROMPT = 'You are a helpful research assistant.'
+
+LLM_TIMEOUT = float(os.getenv('LLM_TIMEOUT', '120'))
+LLM_MAX_CONNECTIONS = int(os.getenv('LLM_MAX_CONNECTIONS', '200'))
+
+# Threads for the parts of one request that run side by side, such as the
+# per-document index loads and searches of a multi-document question. They
+# mostly wait, for a scheduler slot or on the vector service. Enough for every
+# job the scheduler can admit or queue, so jobs reach the scheduler in
+# priority order rather than queueing here.
+wait_executor = ThreadPoolExecutor(
+    max_workers=sum(w['slots'] + w['max_queue'] for w in WORKLOADS.values()),
+    thread_name_prefix='wait',
+)
+
+# One event loop and one pooled AsyncClient per process. Both are created on
+# first use, i.e. after gunicorn has forked, since threads don't survive fork.
+_loop = None
+_client = None
+_loop_lock = threading.Lock()
+
+
+def _llm_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _client
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='llm-loop', daemon=True).start()
+            _client = httpx.AsyncClient(
+                timeout=LLM_TIMEOUT,
+                limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                                    max_keepalive_connections=LLM_MAX_CONNECTIONS),
+            )
+            _loop = loop
+    return _loop
+
+
+def build_payload(prompt: str, model: str = DEFAULT_MODEL) -> dict:
+    return {
+        'model': model,
+        'messages': [
+            {'role': 'system', 'content': SYSTEM_PROMPT},
+            {'role': 'user', 'content': prompt}
+        ]
+    }
+
+
+async def _post(prompt: str, model: str) -> str:
+    headers = {
+        'Authorization': f'Bearer {OPENROUTER_API_KEY}',
+        'Content-Type': 'application/json',
+    }
+    resp = await _client.post(OPENROUTER_API_URL, headers=headers, json=build_payload(prompt, model))
+    resp.raise_for_status()
+    return resp.json()['choices'][0]['message']['content']
+
+
+def chat_completion(prompt: str, model: str = DEFAULT_MODEL) -> str:
+    """
+    Send a single-turn chat completion and block until the reply text arrives.
+    The call runs on the shared LLM loop, so it reuses the pooled connections.
+    """
+    return asyncio.run_coroutine_threadsafe(_post(prompt, model), _llm_loop()).result()
+
+
+async def chat_completion_async(prompt: str, model: str = DEFAULT_MODEL) -> str:
+    """
+    Send a single-turn chat completion and return the reply text.
+    Safe to await from any event loop; the request itself always runs on the
+    shared LLM loop so every caller in the process shares one connection pool.
+    """
+    future = asyncio.run_coroutine_threadsafe(_post(prompt, model), _llm_loop())
+    return await asyncio.wrap_future(future)
+
@@ -0,0 +1,22 @@
+from typing import Tuple, Union
+import numpy as np
+import easyocr
+from PIL import Image
+
+
+# Loaded once at import so a pre-forked server shares the weights between workers
+ocr_reader = easyocr.Reader(['en'])
+
+
+def read_image_result(image: Union[str, Image.Image]) -> Tuple[str, float]:
+    """OCR an image path or PIL image; returns the text and its length-weighted mean confidence."""
+    img = Image.open(image) if isinstance(image, str) else image
+    results = ocr_reader.readtext(np.array(img.convert('RGB')))
+    text = ' '.join([t[1] for t in results])
+    weight = sum(len(t[1]) for t in results)
+    confidence = sum(len(t[1]) * t[2] for t in results) / weight if weight else 0.0
+    return text, float(confidence)
+
+
+def read_image_text(image_path: str) -> str:
+    return read_image_result(image_path)[0]
@@ -0,0 +1,98 @@
+import os
+import json
+import shutil
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, Iterable, Tuple
+from .chunker import chunk_pages
+from .extraction import extract_pages
+from .index_store import INDEX_FOLDER, INDEX_VERSION, store_document, indexed_documents, index_versions, vector_client
+
+
+CHECKPOINT_PATH = os.path.join(INDEX_FOLDER, 'reindex-checkpoint.json')
+
+
+def _init_worker(threads: int) -> None:
+    import torch
+    torch.set_num_threads(threads)
+
+
+def rebuild_document(pdf_id: int, user_id: int, file_path: str, is_image: bool) -> int:
+    """
+    Extract, chunk and index one document at INDEX_VERSION, locally or on
+    the owner's vector service shard. Runs in a pool process.
+    """
+    chunks = chunk_pages(extract_pages(file_path, is_image))
+    if not chunks:
+        raise ValueError("No text extracted")
+    store_document(user_id, pdf_id, chunks)
+    return len(chunks)
+
+
+def load_checkpoint(path: str) -> Dict:
+    try:
+        with open(path, encoding='utf-8') as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        state = None
+    if not state or state.get('version') != INDEX_VERSION:
+        # A checkpoint for another version says nothing about this one
+        return {'version': INDEX_VERSION, 'done': [], 'failed': {}}
+    return state
+
+
+def save_checkpoint(path: str, state: Dict) -> None:
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(path + '.tmp', path)
+
+
+def reindex(documents: Iterable[Tuple[int, int, str, bool]], workers: int, threads: int = 1,
+            checkpoint_path: str = CHECKPOINT_PATH, force: bool = False,
+            echo: Callable[[str], None] = print) -> Dict:
+    """
+    Rebuild ``(pdf_id, user_id, file_path, is_image)`` documents at INDEX_VERSION in a
+    process pool. Progress is checkpointed after every document, so an
+    interrupted run resumes where it stopped. Documents that already have a
+    current-version index are skipped unless ``force``. Each index becomes
+    visible to the service as soon as it is written; until then the
+    document is still answered from its previous version.
+    """
+    state = load_checkpoint(checkpoint_path)
+    if force:
+        state = {'version': INDEX_VERSION, 'done': [], 'failed': {}}
+    # The services report pdf_ids but not versions, so remotely only the checkpoint counts
+    current = indexed_documents(INDEX_VERSION) if vector_client is None else set()
+    skip = set(state['done']) | (set() if force else current)
+    todo = [doc for doc in documents if doc[0] not in skip]
+    echo(f"Re-indexing {len(todo)} documents at {INDEX_VERSION} with {workers} workers")
+
+    # Spawned so children start clean instead of inheriting this process's torch threads
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker, initargs=(threads,)) as pool:
+        futures = {pool.submit(rebuild_document, *doc): doc[0] for doc in todo}
+        for n, future in enumerate(as_completed(futures), start=1):
+            pdf_id = futures[future]
+            try:
+                chunk_count = future.result()
+                state['done'].append(pdf_id)
+                state['failed'].pop(str(pdf_id), None)
+                echo(f"[{n}/{len(todo)}] {pdf_id}: {chunk_count} chunks")
+            except Exception as e:
+                state['failed'][str(pdf_id)] = str(e)
+                echo(f"[{n}/{len(todo)}] {pdf_id}: failed: {e}")
+            save_checkpoint(checkpoint_path, state)
+    return state
+
+
+def prune_versions() -> None:
+    """Delete every index version except INDEX_VERSION, including unversioned files."""
+    for version in index_versions():
+        if version == INDEX_VERSION:
+            continue
+        if version:
+            shutil.rmtree(os.path.join(INDEX_FOLDER, version), ignore_errors=True)
+        else:
+            for name in os.listdir(INDEX_FOLDER):
+                if name.endswith(('.faiss', '.json')) and name.split('.')[0].isdigit():
+                    os.remove(os.path.join(INDEX_FOLDER, name))
@@ -0,0 +1,121 @@
+import os
+import math
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+
+
+# CPU units this worker process hands out. Each job reserves ``threads`` units,
+# which should match the torch/BLAS threads it uses (WORKER_TORCH_THREADS).
+CPU_UNITS = int(os.getenv('CPU_WORKERS', os.cpu_count() or 1))
+
+
+def _setting(workload, key, default):
+    return int(os.getenv(f'SCHED_{workload.upper()}_{key.upper()}', default))
+
+
+def _workload(name, priority, slots, max_queue, threads=1):
+    return {
+        'priority': priority,
+        'slots': _setting(name, 'slots', slots),
+        'threads': min(_setting(name, 'threads', threads), CPU_UNITS),
+        'max_queue': _setting(name, 'max_queue', max_queue),
+    }
+
+
+# Lower priority runs first. Interactive QA may use every unit; the heavy
+# model workloads are each capped so one kind of upload can't take the CPU.
+WORKLOADS = {
+    'qa': _workload('qa', 0, slots=CPU_UNITS, max_queue=64),
+    'ocr': _workload('ocr', 1, slots=max(CPU_UNITS // 2, 1), max_queue=8),
+    'transcribe': _workload('transcribe', 1, slots=max(CPU_UNITS // 2, 1), max_queue=8),
+    'extract': _workload('extract', 1, slots=max(CPU_UNITS // 2, 1), max_queue=16),
+    'ingest': _workload('ingest', 2, slots=max(CPU_UNITS // 2, 1), max_queue=16),
+    # Whole bulk-upload requests. Holds no CPU units itself; its embedding
+    # jobs each take an 'ingest' slot.
+    'bulk': _workload('bulk', 2, slots=1, max_queue=2, threads=0),
+}
+
+
+class Overloaded(Exception):
+    """Raised when a workload's queue is full; surfaced as 429 + Retry-After."""
+
+    def __init__(self, workload, retry_after):
+        super().__init__(f"{workload} queue is full")
+        self.workload = workload
+        self.retry_after = retry_after
+
+
+class Scheduler:
+    """
+    Priority admission for CPU-bound work. A job waits until its workload has
+    a free slot and enough CPU units are free. Among waiters, the one with the
+    best (priority, arrival) order whose workload has a free slot runs next.
+    Jobs that would exceed their workload's ``max_queue`` are rejected.
+    """
+
+    def __init__(self, units, workloads):
+        self.units = units
+        self.workloads = workloads
+        self._free = units
+        self._running = {name: 0 for name in workloads}
+        self._queued = {name: 0 for name in workloads}
+        # Smoothed job duration per workload, used for Retry-After
+        self._avg_seconds = {name: 1.0 for name in workloads}
+        self._waiting = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def _next(self):
+        for item in sorted(self._waiting):
+            config = self.workloads[item[2]]
+            if self._running[item[2]] >= config['slots']:
+                continue
+            # Don't let cheaper jobs behind it starve the first runnable one
+            return item if self._free >= config['threads'] else None
+        return None
+
+    def _retry_after(self, workload):
+        config = self.workloads[workload]
+        backlog = self._queued[workload] + self._running[workload]
+        return max(1, math.ceil(backlog * self._avg_seconds[workload] / config['slots']))
+
+    def acquire(self, workload):
+        config = self.workloads[workload]
+        with self._cond:
+            if self._queued[workload] >= config['max_queue']:
+                raise Overloaded(workload, self._retry_after(workload))
+            item = (config['priority'], next(self._seq), workload)
+            self._waiting.append(item)
+            self._queued[workload] += 1
+            try:
+                while self._next() is not item:
+                    self._cond.wait()
+            finally:
+                self._waiting.remove(item)
+                self._queued[workload] -= 1
+            self._running[workload] += 1
+            self._free -= config['threads']
+            # Another waiter may be runnable too
+            self._cond.notify_all()
+        return time.monotonic()
+
+    def release(self, workload, started):
+        with self._cond:
+            self._running[workload] -= 1
+            self._free += self.workloads[workload]['threads']
+            elapsed = time.monotonic() - started
+            self._avg_seconds[workload] = 0.8 * self._avg_seconds[workload] + 0.2 * elapsed
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, workload):
+        started = self.acquire(workload)
+        try:
+            yield
+        finally:
+            self.release(workload, started)
+
+
+scheduler = Scheduler(CPU_UNITS, WORKLOADS)
@@ -0,0 +1,117 @@
+import os
+import json
+import uuid
+import threading
+from typing import Callable, Dict, Optional
+from cachetools import LRUCache
+
+
+# Shared answers never change once created, so entries are kept until evicted
+SHARE_CACHE_SIZE = int(os.getenv('SHARE_CACHE_SIZE', '10000'))
+# Optional folder shared by every worker on the host (e.g. on tmpfs), standing
+# in for a local cache server: a share loaded by one worker is served by the
+# others without a database query.
+SHARE_CACHE_DIR = os.getenv('SHARE_CACHE_DIR')
+if SHARE_CACHE_DIR:
+    os.makedirs(SHARE_CACHE_DIR, exist_ok=True)
+# The folder is trimmed back to 90% of this, least recently read first, when
+# a write pushes it over
+SHARE_CACHE_DIR_MAX_BYTES = int(os.getenv('SHARE_CACHE_DIR_MAX_MB', '64')) * 1024 * 1024
+# Writes between size checks of the folder
+SHARE_CACHE_DIR_CHECK_EVERY = 64
+
+_cache = LRUCache(maxsize=SHARE_CACHE_SIZE)
+_lock = threading.Lock()
+_writes = 0
+
+
+def parse_token(token: str) -> Optional[bytes]:
+    """The 16-byte key for a share token, hyphenated or plain hex; None if it isn't one."""
+    try:
+        return uuid.UUID(token).bytes
+    except (ValueError, TypeError):
+        return None
+
+
+def format_token(key: bytes) -> str:
+    return str(uuid.UUID(bytes=key))
+
+
+def _path(key: bytes) -> str:
+    return os.path.join(SHARE_CACHE_DIR, key.hex() + '.json')
+
+
+def _read_shared(key: bytes) -> Optional[Dict]:
+    try:
+        with open(_path(key), encoding='utf-8') as f:
+            share = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    try:
+        # mtime is the last read, so eviction drops the least recently read shares
+        os.utime(_path(key))
+    except FileNotFoundError:
+        pass
+    return share
+
+
+def _trim_shared() -> None:
+    """Delete least recently read files until the folder is under 90% of its budget."""
+    entries = []
+    for entry in os.scandir(SHARE_CACHE_DIR):
+        if entry.name.endswith('.json'):
+            try:
+                st = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    if total <= SHARE_CACHE_DIR_MAX_BYTES:
+        return
+    for _, size, path in sorted(entries):
+        if total <= SHARE_CACHE_DIR_MAX_BYTES * 0.9:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def _write_shared(key: bytes, share: Dict) -> None:
+    path = _path(key)
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(share, f)
+    os.replace(tmp, path)
+    global _writes
+    with _lock:
+        _writes += 1
+        check = _writes % SHARE_CACHE_DIR_CHECK_EVERY == 0
+    if check:
+        _trim_shared()
+
+
+def get_share(key: bytes, load: Callable[[bytes], Optional[Dict]]) -> Optional[Dict]:
+    """
+    Look a share up in this worker's LRU, then in SHARE_CACHE_DIR, and only
+    call ``load(key)`` (the database) when neither has it. Misses are not
+    cached, so unknown tokens cannot evict real shares.
+    """
+    with _lock:
+        share = _cache.get(key)
+    if share is not None:
+        return share
+    share = _read_shared(key) if SHARE_CACHE_DIR else None
+    if share is None:
+        share = load(key)
+        if share is None:
+            return None
+        if SHARE_CACHE_DIR:
+            try:
+                _write_shared(key, share)
+            except OSError as e:
+                print(f"Share cache write failed: {e}")
+    with _lock:
+        _cache[key] = share
+    return share
@@ -0,0 +1,103 @@
+import os
+import asyncio
+import hashlib
+from typing import List
+from sqlalchemy.exc import IntegrityError
+from .. import db
+from ..models import SummaryChunk
+from .llm import chat_completion_async
+
+
+# Documents up to this length are summarized in one call, as before. Longer
+# ones are split into sections of about this size, summarized concurrently and
+# reduced into the final summary.
+SUMMARY_SECTION_CHARS = 4000
+SUMMARY_FANOUT = int(os.getenv('SUMMARY_FANOUT', '10'))
+SUMMARY_MAX_ROUNDS = 3
+# Bump when the prompts change so cached partial summaries are not reused
+SUMMARY_PROMPT_VERSION = 'v1'
+
+FINAL_PROMPT = "Summarize the following research paper in a short paragraph. Then, list 3-5 key points and highlight the most important sentences.\n\nPaper:\n{text}"
+SECTION_PROMPT = "Summarize this section of a research paper in 4-6 sentences. Keep the key methods, results, numbers and named entities.\n\nSection:\n{text}"
+REDUCE_PROMPT = "The following are summaries of consecutive sections of one research paper. Summarize the paper in a short paragraph. Then, list 3-5 key points and highlight the most important sentences.\n\nSection summaries:\n{text}"
+
+
+def split_sections(content: str, max_chars: int = SUMMARY_SECTION_CHARS) -> List[str]:
+    """Split on paragraph breaks into sections of at most ``max_chars`` (long paragraphs are cut)."""
+    sections = []
+    current = ''
+    for paragraph in content.split('\n\n'):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        while len(paragraph) > max_chars:
+            if current:
+                sections.append(current)
+                current = ''
+            sections.append(paragraph[:max_chars])
+            paragraph = paragraph[max_chars:]
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            sections.append(current)
+            current = ''
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        sections.append(current)
+    return sections
+
+
+def _hash(prompt: str) -> str:
+    return hashlib.sha256(f"{SUMMARY_PROMPT_VERSION}\n{prompt}".encode('utf-8')).hexdigest()
+
+
+async def _summarize_all(prompts: List[str]) -> List[str]:
+    """
+    Run ``prompts`` concurrently (SUMMARY_FANOUT at a time), reusing cached
+    results by prompt hash and storing the new ones in a single commit. If a
+    call fails, the others still finish and are stored before it is raised.
+    """
+    hashes = [_hash(p) for p in prompts]
+    cached = {row.chunk_hash: row.summary
+              for row in SummaryChunk.query.filter(SummaryChunk.chunk_hash.in_(set(hashes)))}
+    missing = {h: p for h, p in zip(hashes, prompts) if h not in cached}
+    semaphore = asyncio.Semaphore(SUMMARY_FANOUT)
+
+    async def run(prompt):
+        async with semaphore:
+            return await chat_completion_async(prompt)
+
+    results = await asyncio.gather(*[run(p) for p in missing.values()], return_exceptions=True)
+    failed = [r for r in results if isinstance(r, BaseException)]
+    for chunk_hash, summary in zip(missing, results):
+        if isinstance(summary, BaseException):
+            continue
+        cached[chunk_hash] = summary
+        db.session.add(SummaryChunk(chunk_hash=chunk_hash, summary=summary))
+    if len(failed) < len(missing):
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another request cached the same section first
+            db.session.rollback()
+    if failed:
+        # The sections that did finish are cached, so a retry only pays for the rest
+        raise failed[0]
+    return [cached[h] for h in hashes]
+
+
+async def summarize_content(content: str) -> str:
+    """
+    Summarize a whole document. Short documents take one LLM call; longer
+    ones are map-reduced, so wall time stays near two calls regardless of
+    length and a re-run only pays for sections whose text changed.
+    """
+    if len(content) <= SUMMARY_SECTION_CHARS:
+        return (await _summarize_all([FINAL_PROMPT.format(text=content)]))[0]
+    partials = await _summarize_all([SECTION_PROMPT.format(text=s) for s in split_sections(content)])
+    combined = '\n\n'.join(partials)
+    # Very long papers: reduce the section summaries again until they fit one call
+    for _ in range(SUMMARY_MAX_ROUNDS):
+        if len(combined) <= SUMMARY_SECTION_CHARS:
+            break
+        partials = await _summarize_all([SECTION_PROMPT.format(text=s) for s in split_sections(combined)])
+        combined = '\n\n'.join(partials)
+    return (await _summarize_all([REDUCE_PROMPT.format(text=combined)]))[0]
@@ -0,0 +1,75 @@
+import os
+import base64
+import hashlib
+from collections import namedtuple
+from typing import Dict, List, Optional, Set, Tuple
+import httpx
+import numpy as np
+
+
+VECTOR_SERVICE_TIMEOUT = float(os.getenv('VECTOR_SERVICE_TIMEOUT', '30'))
+
+# A document index held by a vector service at ``url``
+RemoteDocument = namedtuple('RemoteDocument', ['pdf_id', 'url', 'model', 'version'])
+
+
+def encode_vectors(vectors: np.ndarray) -> Dict:
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    return {'shape': list(vectors.shape), 'data': base64.b64encode(vectors.tobytes()).decode('ascii')}
+
+
+def decode_vectors(payload: Dict) -> np.ndarray:
+    return np.frombuffer(base64.b64decode(payload['data']), dtype='float32').reshape(payload['shape'])
+
+
+class VectorClient:
+    """
+    Talks to one or more vector services (see vector_service.py). Each user's
+    documents live on one service, picked by rendezvous hashing, so adding a
+    service only moves the users that now hash to it.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.urls = [url.rstrip('/') for url in urls]
+        self._http = httpx.Client(timeout=VECTOR_SERVICE_TIMEOUT)
+
+    def shard(self, user_id: int) -> str:
+        def score(url):
+            return hashlib.sha1(f"{url}|{int(user_id)}".encode('utf-8')).digest()
+        return max(self.urls, key=score)
+
+    def info(self, url: str, pdf_id: int) -> Optional[Dict]:
+        """The stored index's ``{'model', 'version', 'chunks'}``, or None if it has none."""
+        resp = self._http.get(f"{url}/index/{int(pdf_id)}")
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.json()
+
+    def add(self, url: str, pdf_id: int, chunks: List[Dict], vectors: np.ndarray, model: str) -> Dict:
+        resp = self._http.put(f"{url}/index/{int(pdf_id)}",
+                              json={'chunks': chunks, 'vectors': encode_vectors(vectors), 'model': model})
+        resp.raise_for_status()
+        return resp.json()
+
+    def search(self, doc: RemoteDocument, queries: np.ndarray, k: int) -> List[List[Tuple[float, Dict]]]:
+        resp = self._http.post(f"{doc.url}/index/{doc.pdf_id}/search",
+                               json={'queries': encode_vectors(queries), 'k': k, 'model': doc.model})
+        resp.raise_for_status()
+        return [[(hit['distance'], hit['chunk']) for hit in row] for row in resp.json()['results']]
+
+    def delete(self, pdf_id: int, url: Optional[str] = None) -> None:
+        """Drop a document's index from ``url``, or from every service if the shard is unknown."""
+        for target in ([url] if url else self.urls):
+            resp = self._http.delete(f"{target}/index/{int(pdf_id)}")
+            if resp.status_code != 404:
+                resp.raise_for_status()
+
+    def documents(self) -> Set[int]:
+        """Every pdf_id with an index on any service."""
+        pdf_ids = set()
+        for url in self.urls:
+            resp = self._http.get(f"{url}/index")
+            resp.raise_for_status()
+            pdf_ids.update(resp.json()['documents'])
+        return pdf_ids
@@ -0,0 +1,79 @@
+"""
+Standalone vector search service. Owns the per-document FAISS indexes of the
+users sharded to it and serves them over local HTTP, so search capacity and
+index memory scale separately from the web workers. Start one per shard:
+
+    INDEX_FOLDER=/srv/indexes/0 python -m app.services.vector_service --port 7001
+
+and point the web app at all of them with
+VECTOR_SERVICE_URLS=http://127.0.0.1:7001,http://127.0.0.1:7002
+"""
+import argparse
+import numpy as np
+from flask import Flask, request, jsonify
+from .index_store import get_index, build_index, drop_index, indexed_documents
+from .vector_client import decode_vectors
+
+
+def _missing():
+    # The service never builds from source documents; clients PUT the vectors
+    raise LookupError
+
+
+def create_vector_app() -> Flask:
+    app = Flask(__name__)
+
+    @app.errorhandler(LookupError)
+    def not_indexed(e):
+        return jsonify({'error': 'Document is not indexed'}), 404
+
+    def describe(doc):
+        return {'model': doc.model, 'version': doc.version, 'chunks': len(doc.chunks)}
+
+    @app.route('/index', methods=['GET'])
+    def documents():
+        return jsonify({'documents': sorted(indexed_documents())})
+
+    @app.route('/index/<int:pdf_id>', methods=['GET'])
+    def info(pdf_id):
+        return jsonify(describe(get_index(pdf_id, _missing)))
+
+    @app.route('/index/<int:pdf_id>', methods=['PUT'])
+    def add(pdf_id):
+        data = request.get_json()
+        if not data or not data.get('chunks') or 'vectors' not in data or 'model' not in data:
+            return jsonify({'error': 'chunks, vectors and model are required'}), 400
+        vectors = decode_vectors(data['vectors'])
+        if len(vectors) != len(data['chunks']):
+            return jsonify({'error': 'One vector per chunk is required'}), 400
+        return jsonify(describe(build_index(pdf_id, data['chunks'], vectors, data['model'])))
+
+    @app.route('/index/<int:pdf_id>/search', methods=['POST'])
+    def search(pdf_id):
+        data = request.get_json()
+        if not data or 'queries' not in data:
+            return jsonify({'error': 'queries are required'}), 400
+        doc = get_index(pdf_id, _missing)
+        if data.get('model') and data['model'] != doc.model:
+            # Rebuilt with another model since the client looked it up
+            return jsonify({'error': 'Model mismatch', **describe(doc)}), 409
+        queries = decode_vectors(data['queries'])
+        D, I = doc.index.search(np.ascontiguousarray(queries), int(data.get('k', 3)))
+        results = [[{'distance': float(d), 'chunk': doc.chunks[i]} for d, i in zip(d_row, i_row) if i >= 0]
+                   for d_row, i_row in zip(D, I)]
+        return jsonify({'results': results})
+
+    @app.route('/index/<int:pdf_id>', methods=['DELETE'])
+    def delete(pdf_id):
+        drop_index(pdf_id)
+        return jsonify({'message': 'Index deleted'})
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve FAISS document indexes over HTTP')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=7001)
+    args = parser.parse_args()
+    create_vector_app().run(host=args.host, port=args.port, threaded=True)
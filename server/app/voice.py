@@ -4,6 +4,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 from .models import PdfData
 from werkzeug.utils import secure_filename
 from faster_whisper import WhisperModel
+from .services.scheduler import scheduler, Overloaded
 
 import os
 import warnings
@@ -33,10 +34,14 @@ def voice_to_text():
 
     try:
         print("[VOICE_TO_TEXT] Starting transcription", file=sys.stderr)
-        segments, _ = whisper_model.transcribe(save_path)
-        text = ''.join([s.text for s in segments]).strip()
+        with scheduler.slot('transcribe'):
+            segments, _ = whisper_model.transcribe(save_path)
+            # segments is lazy; decoding happens while iterating
+            text = ''.join([s.text for s in segments]).strip()
         print(f"[VOICE_TO_TEXT] Transcription result: {text}", file=sys.stderr)
         return jsonify({"transcription": text}), 200
+    except Overloaded:
+        raise
     except Exception as e:
         import traceback
         print(f"[VOICE_TO_TEXT] Whisper failed: {e}", file=sys.stderr)
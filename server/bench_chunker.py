@@ -0,0 +1,158 @@
+"""
+Benchmark the chunkers on large documents for speed and retrieval hit rate.
+
+    python bench_chunker.py paper.pdf other.pdf --queries 200 --top-k 3
+    python bench_chunker.py --synthetic 2000 --no-retrieval
+    python bench_chunker.py paper.pdf --retriever tfidf
+
+Compares the sentence/paragraph chunker in app/services/chunker.py with the
+two it replaced: textwrap at 1024 characters (upload) and 500-character
+slices (QA). Retrieval is measured with sentences sampled from the document
+as queries: a query is a hit when one of the top-k chunks contains the whole
+sentence, so chunkers that cut sentences apart are penalized. ``--retriever
+tfidf`` ranks chunks by TF-IDF cosine instead of MiniLM embeddings, for a
+quick comparison where sentence-transformers is not installed.
+"""
+import re
+import time
+import random
+import argparse
+import textwrap
+import numpy as np
+from app.services.chunker import chunk_pages, count_tokens, CHUNK_TOKENS, CHUNK_OVERLAP
+
+
+def textwrap_1024(pages):
+    text = '\n\n'.join(page['text'] for page in pages)
+    return [{'text': t} for t in textwrap.wrap(text, 1024, break_long_words=False)]
+
+
+def slice_500(pages):
+    return [{'text': page['text'][i:i+500]} for page in pages
+            for i in range(0, len(page['text']), 500) if page['text'][i:i+500].strip()]
+
+
+CHUNKERS = {
+    'textwrap-1024': textwrap_1024,
+    'slice-500': slice_500,
+    f'sentences-{CHUNK_TOKENS}/{CHUNK_OVERLAP}': chunk_pages,
+}
+
+WORDS = ("model data result method training loss layer network attention token sample error "
+         "baseline accuracy dataset feature encoder decoder gradient parameter experiment "
+         "analysis table figure section value increase improve reduce compare show").split()
+
+
+def synthetic_pages(count, seed=0):
+    rng = random.Random(seed)
+
+    def sentence():
+        words = rng.choices(WORDS, k=rng.randint(8, 30))
+        return ' '.join(words).capitalize() + rng.choice('..?')
+
+    def paragraph():
+        # Wrapped like PDF text, with a line break every ~80 characters
+        return textwrap.fill(' '.join(sentence() for _ in range(rng.randint(2, 8))), 80)
+
+    return [{'text': '\n\n'.join(paragraph() for _ in range(rng.randint(3, 6))), 'source': 'text',
+             'confidence': None} for _ in range(count)]
+
+
+def normalize(text):
+    return ' '.join(text.split())
+
+
+def sample_queries(pages, count, seed=0):
+    sentences = []
+    for page in pages:
+        for sentence in re.split(r'(?<=[.!?])\s+', page['text']):
+            if '-\n' not in sentence and len(sentence.split()) >= 8:
+                sentences.append(normalize(sentence))
+    random.Random(seed).shuffle(sentences)
+    return sentences[:count]
+
+
+def tfidf_hit_rate(chunks, queries, top_k):
+    texts = [normalize(chunk['text']) for chunk in chunks]
+    vocab = {}
+    docs = [[vocab.setdefault(w, len(vocab)) for w in re.findall(r"\w+", t.lower())] for t in texts]
+
+    def vectorize(rows):
+        matrix = np.zeros((len(rows), len(vocab)), dtype='float32')
+        for i, ids in enumerate(rows):
+            np.add.at(matrix[i], ids, 1)
+        return matrix
+
+    tf = vectorize(docs)
+    idf = np.log((1 + len(docs)) / (1 + (tf > 0).sum(axis=0))) + 1
+    tf *= idf
+    tf /= np.linalg.norm(tf, axis=1, keepdims=True) + 1e-9
+    q = vectorize([[vocab[w] for w in re.findall(r"\w+", query.lower()) if w in vocab] for query in queries]) * idf
+    top = np.argsort(-(q @ tf.T), axis=1)[:, :top_k]
+    hits = sum(any(query in texts[i] for i in row) for query, row in zip(queries, top))
+    return hits / len(queries)
+
+
+def hit_rate(model, chunks, queries, top_k):
+    import faiss
+    texts = [normalize(chunk['text']) for chunk in chunks]
+    vectors = np.asarray(model.encode(texts, batch_size=64), dtype='float32')
+    index = faiss.IndexFlatL2(vectors.shape[1])
+    index.add(vectors)
+    _, I = index.search(np.asarray(model.encode(queries, batch_size=64), dtype='float32'), top_k)
+    hits = sum(any(i >= 0 and query in texts[i] for i in row) for query, row in zip(queries, I))
+    return hits / len(queries)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('pdfs', nargs='*', help='PDF files to benchmark on')
+    parser.add_argument('--synthetic', type=int, default=0, help='Also benchmark this many generated pages')
+    parser.add_argument('--queries', type=int, default=200, help='Sampled sentences per document')
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=3, help='Timing runs per chunker (best is reported)')
+    parser.add_argument('--no-retrieval', action='store_true', help='Only measure speed and chunk sizes')
+    parser.add_argument('--retriever', choices=['minilm', 'tfidf'], default='minilm')
+    args = parser.parse_args()
+
+    documents = []
+    if args.pdfs:
+        from app.services.extraction import extract_pages
+        documents += [(path, extract_pages(path)) for path in args.pdfs]
+    if args.synthetic:
+        documents.append((f'synthetic ({args.synthetic} pages)', synthetic_pages(args.synthetic)))
+    if not documents:
+        parser.error('give PDF files and/or --synthetic N')
+
+    model = None
+    if not args.no_retrieval and args.retriever == 'minilm':
+        from app.services.embedding import get_embedding_model
+        model = get_embedding_model()
+    retrieval = not args.no_retrieval
+
+    for name, pages in documents:
+        size = sum(len(page['text']) for page in pages)
+        print(f"\n{name}: {len(pages)} pages, {size / 1e6:.2f} MB of text")
+        queries = sample_queries(pages, args.queries) if retrieval else []
+        print(f"{'chunker':<22}{'MB/s':>8}{'chunks':>8}{'avg tok':>9}{'>256 tok':>10}"
+              + (f"{f'hit@{args.top_k}':>8}" if queries else ''))
+        for label, chunker in CHUNKERS.items():
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                chunks = chunker(pages)
+                timings.append(time.perf_counter() - start)
+            tokens = [count_tokens(chunk['text']) for chunk in chunks]
+            # Model word pieces, when the model is loaded: what actually gets truncated
+            if model:
+                tokens = [len(model.tokenizer.tokenize(chunk['text'])) for chunk in chunks]
+            row = (f"{label:<22}{size / 1e6 / min(timings):>8.1f}{len(chunks):>8}"
+                   f"{np.mean(tokens):>9.0f}{np.mean(np.array(tokens) > 256):>10.1%}")
+            if queries:
+                rate = hit_rate(model, chunks, queries, args.top_k) if model else tfidf_hit_rate(chunks, queries, args.top_k)
+                row += f"{rate:>8.1%}"
+            print(row)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+import os
+import multiprocessing
+
+# Threads each worker may use for torch / BLAS / FAISS. These variables have to
+# be set before torch is imported, which happens when the app is preloaded.
+WORKER_TORCH_THREADS = int(os.getenv('WORKER_TORCH_THREADS', '1'))
+for var in ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'NUMEXPR_NUM_THREADS'):
+    os.environ.setdefault(var, str(WORKER_TORCH_THREADS))
+# CPU units the scheduler hands out to embedding, FAISS and extraction jobs
+os.environ.setdefault('CPU_WORKERS', str(WORKER_TORCH_THREADS))
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+workers = int(os.getenv('WEB_CONCURRENCY', max(multiprocessing.cpu_count() // WORKER_TORCH_THREADS, 1)))
+worker_class = 'gthread'
+# One thread per request. Most of them sit waiting on the LLM, which costs no
+# CPU; see "LLM-bound endpoints" in README.md
+threads = int(os.getenv('WORKER_THREADS', '32'))
+timeout = int(os.getenv('WORKER_TIMEOUT', '120'))
+
+# Load the models in the master before forking
+preload_app = True
+wsgi_app = 'wsgi:app'
+
+
+def post_fork(server, worker):
+    import torch
+    import faiss
+    torch.set_num_threads(WORKER_TORCH_THREADS)
+    faiss.omp_set_num_threads(WORKER_TORCH_THREADS)
+    server.log.info(f"Worker {worker.pid} limited to {WORKER_TORCH_THREADS} compute thread(s)")
@@ -0,0 +1,65 @@
+import time
+import threading
+import pytest
+from app.services.scheduler import Scheduler, Overloaded
+
+
+def make_scheduler(units=1, **workloads):
+    return Scheduler(units, {
+        name: {'priority': priority, 'slots': slots, 'threads': 1, 'max_queue': max_queue}
+        for name, (priority, slots, max_queue) in workloads.items()
+    })
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_higher_priority_runs_first():
+    scheduler = make_scheduler(qa=(0, 1, 10), ingest=(2, 1, 10))
+    held = scheduler.acquire('ingest')
+    order = []
+
+    def job(workload):
+        with scheduler.slot(workload):
+            order.append(workload)
+
+    threads = [threading.Thread(target=job, args=('ingest',))]
+    threads[0].start()
+    wait_until(lambda: scheduler._queued['ingest'] == 1)
+    threads.append(threading.Thread(target=job, args=('qa',)))
+    threads[1].start()
+    wait_until(lambda: scheduler._queued['qa'] == 1)
+
+    scheduler.release('ingest', held)
+    for thread in threads:
+        thread.join(5)
+    assert order == ['qa', 'ingest']
+
+
+def test_full_queue_is_shed():
+    scheduler = make_scheduler(ocr=(1, 1, 1))
+    held = scheduler.acquire('ocr')
+    waiter = threading.Thread(target=lambda: scheduler.release('ocr', scheduler.acquire('ocr')))
+    waiter.start()
+    wait_until(lambda: scheduler._queued['ocr'] == 1)
+
+    with pytest.raises(Overloaded) as e:
+        scheduler.acquire('ocr')
+    assert e.value.workload == 'ocr'
+    assert e.value.retry_after >= 1
+
+    scheduler.release('ocr', held)
+    waiter.join(5)
+    assert scheduler._running['ocr'] == 0 and scheduler._free == 1
+
+
+def test_slot_is_released_when_the_job_raises():
+    scheduler = make_scheduler(qa=(0, 1, 10))
+    with pytest.raises(ValueError):
+        with scheduler.slot('qa'):
+            raise ValueError
+    assert scheduler._running['qa'] == 0 and scheduler._free == 1
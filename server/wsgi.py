@@ -0,0 +1,15 @@
+import gc
+from app import create_app, db
+
+# Imported by gunicorn in the master process (preload_app), so the MiniLM,
+# Whisper and EasyOCR weights are loaded once here and shared copy-on-write
+# with every forked worker.
+app = create_app()
+
+with app.app_context():
+    db.create_all()
+
+# Move everything loaded so far out of the collector's reach. Otherwise the
+# first collection in each worker touches every object header and copies the
+# shared pages into the worker.
+gc.freeze()